@@ -7,16 +7,27 @@ from fastapi import FastAPI
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 
+from services.background import BackgroundService
+from services.boardCache import BoardCache
 from services.db import DBService
 from services.plugin import PluginService
-from services.socketio import sio
+from services.pubsub import PubSubService
+from services.socketio import sio, startHeartbeat, stopHeartbeat
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     PluginService.loadPlugins()
     await DBService.run()
+    await BoardCache.run()
+    await PubSubService.run()
+    await BackgroundService.run()
+    await startHeartbeat()
     yield
+    await stopHeartbeat()
+    await PubSubService.shutdown()
+    await BackgroundService.shutdown()
+    await DBService.shutdown()
 
 
 fastAPI = FastAPI(
@@ -13,7 +13,7 @@ class Emoji(BaseModel):
 
 class Reaction(BaseModel):
     emoji: Emoji
-    userIds: List[str]
+    userIds: List[str] = []
     count: Optional[int] = None
 
     model_config = ConfigDict(
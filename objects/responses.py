@@ -10,6 +10,7 @@ from .reactions import Reaction
 class Response(BaseModel):
     id: str
     parentId: str
+    num: int
     createdAt: datetime
     authorId: str
     shownId: str
@@ -17,6 +18,7 @@ class Response(BaseModel):
     content: str
     reactions: List[Reaction]
     attributes: Dict[str, Any]
+    deleted: bool = False
 
     model_config = ConfigDict(
         alias_generator=to_snake, populate_by_name=True, serialize_by_alias=False
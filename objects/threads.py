@@ -10,10 +10,12 @@ class Thread(BaseModel):
     board: str
     title: str
     createdAt: datetime
+    modifiedAt: datetime
     sortKey: int
     ownerId: str
     ownerShownId: str
     count: int
+    lastNum: int
     attributes: Dict[str, Any]
 
     model_config = ConfigDict(
@@ -0,0 +1,39 @@
+"""Add count to threads
+
+Revision ID: 3b7e1f0c9a42
+Revises: 91c0a060321e
+Create Date: 2026-10-18 10:02:13.482915
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3b7e1f0c9a42"
+down_revision: Union[str, Sequence[str], None] = "91c0a060321e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "threads",
+        sa.Column("count", sa.Integer, nullable=False, server_default="0"),
+    )
+    op.execute(
+        """
+            UPDATE threads
+            SET count = (
+                SELECT COUNT(*) FROM responses WHERE responses.parent_id = threads.id
+            )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("threads", "count")
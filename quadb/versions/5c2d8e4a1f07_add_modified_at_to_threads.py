@@ -0,0 +1,49 @@
+"""Add modified_at to threads
+
+Revision ID: 5c2d8e4a1f07
+Revises: 3b7e1f0c9a42
+Create Date: 2026-10-18 11:24:51.093127
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5c2d8e4a1f07"
+down_revision: Union[str, Sequence[str], None] = "3b7e1f0c9a42"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "threads",
+        sa.Column(
+            "modified_at",
+            sa.TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+    op.execute(
+        """
+            UPDATE threads
+            SET modified_at = GREATEST(
+                threads.created_at,
+                (
+                    SELECT MAX(created_at)
+                    FROM responses
+                    WHERE responses.parent_id = threads.id
+                )
+            )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("threads", "modified_at")
@@ -0,0 +1,56 @@
+"""Add board_id and key to threads
+
+Revision ID: 8f1a6d3b2c95
+Revises: 5c2d8e4a1f07
+Create Date: 2026-10-18 13:07:38.615204
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8f1a6d3b2c95"
+down_revision: Union[str, Sequence[str], None] = "5c2d8e4a1f07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("threads", sa.Column("board_id", sa.VARCHAR, nullable=True))
+    op.add_column("threads", sa.Column("key", sa.BigInteger, nullable=True))
+    op.execute(
+        """
+            UPDATE threads
+            SET board_id = substring(id from '^(.*)_[0-9]+$'),
+            key = substring(id from '_([0-9]+)$')::bigint
+        """
+    )
+    op.alter_column("threads", "board_id", nullable=False)
+    op.alter_column("threads", "key", nullable=False)
+
+    op.create_index(
+        "ix_threads_board_id_key", "threads", ["board_id", "key"], unique=True
+    )
+    op.create_index(
+        "ix_threads_board_id_deleted_sort_key",
+        "threads",
+        ["board_id", "deleted", sa.text("sort_key DESC"), sa.text("key DESC")],
+    )
+    op.create_index(
+        "ix_responses_parent_id_created_at",
+        "responses",
+        ["parent_id", "created_at"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_responses_parent_id_created_at", "responses")
+    op.drop_index("ix_threads_board_id_deleted_sort_key", "threads")
+    op.drop_index("ix_threads_board_id_key", "threads")
+    op.drop_column("threads", "key")
+    op.drop_column("threads", "board_id")
@@ -0,0 +1,108 @@
+"""Create reactions table
+
+Revision ID: a4e9c7b15d32
+Revises: 8f1a6d3b2c95
+Create Date: 2026-10-18 15:41:09.270356
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a4e9c7b15d32"
+down_revision: Union[str, Sequence[str], None] = "8f1a6d3b2c95"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "reactions",
+        sa.Column("response_id", sa.VARCHAR, primary_key=True),
+        sa.Column("emoji", sa.VARCHAR, primary_key=True),
+        sa.Column("user_id", sa.VARCHAR, primary_key=True),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+    # 元の配列の順番を created_at に残す (MIN(created_at) で並べ直したときに順番が変わらないように)
+    op.execute(
+        """
+            INSERT INTO reactions (response_id, emoji, user_id, created_at)
+            SELECT responses.id, reaction->'emoji'->>'name', user_id,
+            responses.created_at + position * interval '1 microsecond'
+            FROM responses,
+            json_array_elements(responses.reactions)
+            WITH ORDINALITY AS elements(reaction, position),
+            json_array_elements_text(
+                COALESCE(reaction->'userIds', reaction->'user_ids')
+            ) AS user_id
+            ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute(
+        """
+            UPDATE responses
+            SET reactions = COALESCE(
+                (
+                    SELECT json_agg(
+                        json_build_object(
+                            'emoji', json_build_object('id', NULL, 'name', summary.emoji),
+                            'count', summary.count
+                        )
+                        ORDER BY summary.position
+                    )
+                    FROM (
+                        SELECT reaction->'emoji'->>'name' AS emoji,
+                        json_array_length(
+                            COALESCE(reaction->'userIds', reaction->'user_ids')
+                        ) AS count,
+                        position
+                        FROM json_array_elements(responses.reactions)
+                        WITH ORDINALITY AS elements(reaction, position)
+                    ) AS summary
+                    WHERE summary.count > 0
+                ),
+                '[]'::json
+            )
+            WHERE json_array_length(responses.reactions) > 0
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(
+        """
+            UPDATE responses
+            SET reactions = COALESCE(
+                (
+                    SELECT json_agg(
+                        json_build_object(
+                            'emoji', json_build_object('id', NULL, 'name', summary.emoji),
+                            'userIds', summary.user_ids
+                        )
+                        ORDER BY summary.first
+                    )
+                    FROM (
+                        SELECT emoji,
+                        json_agg(user_id ORDER BY created_at) AS user_ids,
+                        MIN(created_at) AS first
+                        FROM reactions
+                        WHERE reactions.response_id = responses.id
+                        GROUP BY emoji
+                    ) AS summary
+                ),
+                '[]'::json
+            )
+            WHERE json_array_length(responses.reactions) > 0
+        """
+    )
+    op.drop_table("reactions")
@@ -0,0 +1,53 @@
+"""Add num to responses
+
+Revision ID: c61f2a8e4b70
+Revises: a4e9c7b15d32
+Create Date: 2026-10-18 16:55:27.804419
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c61f2a8e4b70"
+down_revision: Union[str, Sequence[str], None] = "a4e9c7b15d32"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("responses", sa.Column("num", sa.Integer, nullable=True))
+    op.execute(
+        """
+            UPDATE responses
+            SET num = numbered.num
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY parent_id ORDER BY created_at ASC, id ASC
+                ) AS num
+                FROM responses
+            ) AS numbered
+            WHERE responses.id = numbered.id
+        """
+    )
+    op.alter_column("responses", "num", nullable=False)
+
+    op.create_index(
+        "ix_responses_parent_id_num", "responses", ["parent_id", "num"], unique=True
+    )
+    op.drop_index("ix_responses_parent_id_created_at", "responses")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(
+        "ix_responses_parent_id_created_at",
+        "responses",
+        ["parent_id", "created_at"],
+    )
+    op.drop_index("ix_responses_parent_id_num", "responses")
+    op.drop_column("responses", "num")
@@ -0,0 +1,41 @@
+"""Add last_num to threads
+
+Revision ID: e2b9f4d61a38
+Revises: c61f2a8e4b70
+Create Date: 2026-10-18 18:12:40.517302
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e2b9f4d61a38"
+down_revision: Union[str, Sequence[str], None] = "c61f2a8e4b70"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "threads",
+        sa.Column("last_num", sa.Integer, nullable=False, server_default="0"),
+    )
+    op.execute(
+        """
+            UPDATE threads
+            SET last_num = (
+                SELECT COALESCE(MAX(num), 0)
+                FROM responses
+                WHERE responses.parent_id = threads.id
+            )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("threads", "last_num")
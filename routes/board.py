@@ -1,20 +1,31 @@
 import traceback
 import urllib.parse
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 
 from objects import Device, RenderingResponseEvent
+from services.boardCache import BoardCache
 from services.boards import (
     getBoard,
+    getBoardRevision,
     getBoards,
     getResponsesInThread,
     getThreadInBoard,
+    getThreadModifiedAt,
     getThreadsInBoard,
+    getThreadsInBoardAfter,
     postResponse,
     postThread,
 )
 from services.cf import isFromCloudflare
+from services.conditional import (
+    isNotModified,
+    makeETag,
+    notModified,
+    validatorHeaders,
+)
 from services.exception import (
     BackendError,
     ContentTooLong,
@@ -28,26 +39,68 @@ router = APIRouter()
 
 
 @router.get("/api/boards")
-async def boards():
+async def boards(request: Request, response: Response):
+    etag = makeETag(BoardCache.version)
+    if isNotModified(request, etag):
+        return notModified(etag)
+
+    response.headers.update(validatorHeaders(etag))
     board = await getBoards()
     return board
 
 
 @router.get("/api/boards/{boardId:str}")
-async def board(boardId: str):
+async def board(request: Request, response: Response, boardId: str):
     try:
         board = await getBoard(boardId)
     except NameError:
         raise HTTPException(404)
 
+    etag = makeETag(BoardCache.versions.get(board.id))
+    if isNotModified(request, etag):
+        return notModified(etag)
+
+    response.headers.update(validatorHeaders(etag))
     return board.model_dump(mode="json")
 
 
 @router.get("/api/boards/{boardId:str}/threads")
-async def threads(boardId: str):
+async def threads(
+    request: Request,
+    response: Response,
+    boardId: str,
+    page: Optional[int] = Query(None, ge=0),
+    after: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    # after は "{sortKey}_{id}" 形式のカーソル
+    cursor = None
+    if after is not None:
+        try:
+            sortKey, key = after.split("_", 1)
+            cursor = (int(sortKey), int(key))
+        except ValueError:
+            raise HTTPException(400, detail="INVALID_CURSOR")
+
     try:
         board = await getBoard(boardId)
-        threads = await getThreadsInBoard(board.id)
+
+        # 一覧が変わるときは必ず板のリビジョンが上がるので、DBを見る前に比較できる
+        etag = makeETag(
+            BoardCache.versions.get(board.id), await getBoardRevision(board.id)
+        )
+        if isNotModified(request, etag):
+            return notModified(etag)
+        response.headers.update(validatorHeaders(etag))
+
+        if page is not None and cursor is None:
+            threads = await getThreadsInBoard(board.id, page)
+        else:
+            threads = await getThreadsInBoardAfter(board.id, cursor, limit)
+            if len(threads) >= limit:
+                response.headers["X-Next-Cursor"] = (
+                    f"{threads[-1].sortKey}_{threads[-1].id}"
+                )
     except NameError:
         raise HTTPException(404)
 
@@ -58,11 +111,27 @@ async def threads(boardId: str):
 
 
 @router.get("/api/boards/{boardId:str}/threads/{threadId:int}")
-async def responses(boardId: str, threadId: int):
+async def responses(
+    request: Request,
+    response: Response,
+    boardId: str,
+    threadId: int,
+    since: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+):
     try:
         board = await getBoard(boardId)
+
+        modifiedAt = await getThreadModifiedAt(board.id, threadId)
+        etag = makeETag(modifiedAt.timestamp())
+        if isNotModified(request, etag):
+            return notModified(etag)
+        response.headers.update(validatorHeaders(etag))
+
         thread = await getThreadInBoard(board.id, threadId)
-        responses = await getResponsesInThread(board.id, thread.id)
+        responses = await getResponsesInThread(
+            board.id, thread.id, since=since, limit=limit
+        )
     except NameError:
         raise HTTPException(404)
 
@@ -80,7 +149,6 @@ async def responses(boardId: str, threadId: int):
         del response.authorId
 
         for reaction in response.reactions:
-            reaction.count = len(reaction.userIds)
             del reaction.userIds
 
     return [response.model_dump(mode="json") for response in responses]
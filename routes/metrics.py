@@ -0,0 +1,64 @@
+import os
+import secrets
+
+import dotenv
+from fastapi import APIRouter, HTTPException
+
+from services.background import BackgroundService
+from services.boards import idCache
+from services.dat import datCache
+from services.id import shownIdCache
+from services.pageCache import pageCache
+from services.socketio import getRoomOccupancy, localRooms
+from services.trip import tripCache
+
+dotenv.load_dotenv()
+
+router = APIRouter()
+
+
+@router.get("/api/metrics", include_in_schema=False)
+async def metrics(token: str = ""):
+    metricsToken = os.getenv("metricsToken")
+    if not metricsToken or not secrets.compare_digest(token, metricsToken):
+        raise HTTPException(404)
+
+    return {
+        "idCache": {
+            "size": len(idCache),
+            "maxSize": idCache.maxSize,
+            "hits": idCache.hits,
+            "misses": idCache.misses,
+        },
+        "datCache": {
+            "size": len(datCache),
+            "maxSize": datCache.maxSize,
+            "bytes": datCache.bytes,
+            "maxBytes": datCache.maxBytes,
+            "hits": datCache.hits,
+            "misses": datCache.misses,
+        },
+        "pageCache": {
+            "size": len(pageCache),
+            "maxSize": pageCache.maxSize,
+            "hits": pageCache.hits,
+            "misses": pageCache.misses,
+        },
+        "shownIdCache": {
+            "size": len(shownIdCache),
+            "maxSize": shownIdCache.maxSize,
+            "hits": shownIdCache.hits,
+            "misses": shownIdCache.misses,
+        },
+        "tripCache": {
+            "size": len(tripCache),
+            "maxSize": tripCache.maxSize,
+            "hits": tripCache.hits,
+            "misses": tripCache.misses,
+        },
+        "background": BackgroundService.metrics(),
+        "rooms": {
+            "local": localRooms,
+            "global": await getRoomOccupancy(),
+        },
+    }
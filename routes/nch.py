@@ -1,25 +1,33 @@
 import html
 import traceback
-from typing import Dict
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
 from urllib.parse import parse_qs, quote
 
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import PlainTextResponse, RedirectResponse, Response
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-from objects import Device, RenderingResponseEvent
 from routes.front import version
+from services.boardCache import BoardCache
 from services.boards import (
     getBoard,
+    getBoardRevision,
     getBoards,
-    getResponsesInThread,
     getThreadInBoard,
-    getThreadsInBoard,
+    getThreadModifiedAt,
     postResponse,
     postThread,
 )
 from services.cf import isFromCloudflare
-from services.db import DBService
+from services.conditional import (
+    isNotModified,
+    makeETag,
+    notModified,
+    validatorHeaders,
+)
+from services.dat import getDat
 from services.exception import (
     BackendError,
     ContentTooLong,
@@ -27,7 +35,8 @@ from services.exception import (
     PostRateLimit,
     VerificationRequired,
 )
-from services.plugin import PluginService
+from services.pageCache import getCachedPage
+from services.subject import getSubject
 
 router = APIRouter()
 env = Environment(
@@ -45,80 +54,96 @@ def renderSJISPage(name: str, context: Dict[str, str]) -> bytes:
 
 @router.get("/bbsmenu.html")
 async def index(request: Request):
+    etag = makeETag(version, BoardCache.version)
+    if isNotModified(request, etag):
+        return notModified(etag)
+
+    boards = await getBoards()
     return Response(
-        content=renderSJISPage(
-            "bbsmenu.html",
-            {"request": request, "version": version, "boards": await getBoards()},
+        content=getCachedPage(
+            ("bbsmenu.html", request.url.scheme, request.url.hostname),
+            BoardCache.version,
+            lambda: renderSJISPage(
+                "bbsmenu.html",
+                {"request": request, "version": version, "boards": boards},
+            ),
         ),
+        headers=validatorHeaders(etag),
         media_type="text/html; charset=shift_jis",
     )
 
 
 @router.get("/{boardId:str}/SETTING.TXT", response_class=PlainTextResponse)
-async def board(boardId: str):
+async def board(request: Request, boardId: str):
     try:
         board = await getBoard(boardId)
     except NameError:
         raise HTTPException(404)
 
-    setting = {
-        "BBS_TITLE": board.name,
-        "BBS_TITLE_ORIG": board.name,
-        "BBS_LINE_NUMBER": 16,
-        "BBS_NONAME_NAME": board.anonName,
-        "BBS_SUBJECT_COUNT": 192,
-        "BBS_NAME_COUNT": 128,
-        "BBS_MAIL_COUNT": 9192,
-        "BBS_MESSAGE_COUNT": 9192,
-    }
+    etag = makeETag(BoardCache.versions.get(board.id))
+    if isNotModified(request, etag):
+        return notModified(etag)
+
+    def render() -> bytes:
+        setting = {
+            "BBS_TITLE": board.name,
+            "BBS_TITLE_ORIG": board.name,
+            "BBS_LINE_NUMBER": 16,
+            "BBS_NONAME_NAME": board.anonName,
+            "BBS_SUBJECT_COUNT": 192,
+            "BBS_NAME_COUNT": 128,
+            "BBS_MAIL_COUNT": 9192,
+            "BBS_MESSAGE_COUNT": 9192,
+        }
+        return ("\n".join([f"{key}={value}" for key, value in setting.items()])).encode(
+            "shift_jis"
+        )
 
     return PlainTextResponse(
-        ("\n".join([f"{key}={value}" for key, value in setting.items()])).encode(
-            "shift_jis"
+        getCachedPage(
+            ("SETTING.TXT", board.id), BoardCache.versions.get(board.id), render
         ),
+        headers=validatorHeaders(etag),
         media_type="text/plain; charset=shift_jis",
     )
 
 
 @router.get("/{boardId:str}/head.txt", response_class=PlainTextResponse)
-async def head(boardId: str):
+async def head(request: Request, boardId: str):
     try:
         board = await getBoard(boardId)
     except NameError:
         raise HTTPException(404)
 
+    etag = makeETag(BoardCache.versions.get(board.id))
+    if isNotModified(request, etag):
+        return notModified(etag)
+
     return PlainTextResponse(
-        board.description.encode("shift_jis"),
+        getCachedPage(
+            ("head.txt", board.id),
+            BoardCache.versions.get(board.id),
+            lambda: board.description.encode("shift_jis"),
+        ),
+        headers=validatorHeaders(etag),
         media_type="text/plain; charset=shift_jis",
     )
 
 
 @router.get("/{boardId:str}/subject.txt", response_class=PlainTextResponse)
-async def threads(boardId: str):
+async def threads(request: Request, boardId: str):
     try:
         board = await getBoard(boardId)
-        threads = (
-            (await getThreadsInBoard(board.id, 0))
-            + (await getThreadsInBoard(board.id, 1))
-            + (await getThreadsInBoard(board.id, 2))
-            + (await getThreadsInBoard(board.id, 3))
-        )
     except NameError:
         raise HTTPException(404)
 
-    for thread in threads:
-        del thread.ownerId
+    etag = makeETag(BoardCache.versions.get(board.id), await getBoardRevision(board.id))
+    if isNotModified(request, etag):
+        return notModified(etag)
 
     return PlainTextResponse(
-        (
-            "\n".join(
-                [
-                    f"{thread.id}.dat<>{thread.title} ({thread.count})"
-                    for thread in threads
-                ]
-            )
-            + "\n"
-        ).encode("shift-jis"),
+        await getSubject(board),
+        headers=validatorHeaders(etag),
         media_type="text/plain; charset=shift_jis",
     )
 
@@ -132,53 +157,102 @@ def redirect(boardId: str, threadId: int, options: str):
     return RedirectResponse(f"/{boardId}/{threadId}")
 
 
+def parseRange(header: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, separator, last = spec.strip().partition("-")
+    if not separator:
+        return None
+
+    try:
+        return (int(first) if first else None, int(last) if last else None)
+    except ValueError:
+        return None
+
+
+def getLastModified(modifiedAt: datetime) -> datetime:
+    # Last-Modified は秒までしか表せないので、今の秒のうちの更新は1秒前として出す
+    # (同じ秒にもう1つ書き込まれたとき、If-Modified-Since で304を返し続けないように)
+    lastModified = modifiedAt.replace(microsecond=0)
+    if lastModified >= datetime.now(timezone.utc).replace(microsecond=0):
+        lastModified -= timedelta(seconds=1)
+    return lastModified
+
+
+def isNotModifiedSince(header: Optional[str], lastModified: datetime) -> bool:
+    if not header:
+        return False
+
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    return lastModified <= since
+
+
 @router.get("/{boardId:str}/dat/{threadId:int}.dat", response_class=PlainTextResponse)
-async def responses(boardId: str, threadId: int):
+async def responses(request: Request, boardId: str, threadId: int):
     try:
         board = await getBoard(boardId)
-        thread = await getThreadInBoard(board.id, threadId)
-        responses = await getResponsesInThread(board.id, thread.id)
+        # 更新確認だけならスレッドの行を読まずに返す
+        modifiedAt = await getThreadModifiedAt(board.id, threadId)
     except NameError:
         raise HTTPException(404)
 
-    for response in responses:
-        # Run event
-        event = RenderingResponseEvent(thread, response, Device.Monazilla)
-        for plugin in PluginService.plugins:
-            try:
-                plugin.onRenderingResponse(event)
-            except NotImplementedError:
-                pass
+    etag = makeETag(modifiedAt.timestamp())
+    lastModified = getLastModified(modifiedAt)
+    headers = validatorHeaders(
+        etag,
+        {
+            "Last-Modified": formatdate(lastModified.timestamp(), usegmt=True),
+            "Accept-Ranges": "bytes",
+        },
+    )
 
-        response = event.response
+    # If-None-Match があるときは If-Modified-Since より優先する
+    if request.headers.get("If-None-Match"):
+        if isNotModified(request, etag):
+            return Response(status_code=304, headers=headers)
+    elif isNotModifiedSince(request.headers.get("If-Modified-Since"), lastModified):
+        return Response(status_code=304, headers=headers)
 
-        del response.authorId
+    try:
+        thread = await getThreadInBoard(board.id, threadId)
+    except NameError:
+        raise HTTPException(404)
 
-        if len(response.reactions) > 0:
-            reactions = "\n"
-            for reaction in response.reactions:
-                reactions += f"{reaction.emoji.name} {len(reaction.userIds)} | "
-            reactions = reactions.removesuffix("| ")
+    dat = await getDat(thread)
 
-            response.content += reactions
+    byteRange = parseRange(request.headers.get("Range", ""))
+    if byteRange:
+        first, last = byteRange
+        if first is None:
+            # bytes=-N (末尾Nバイト)
+            first = max(len(dat) - (last or 0), 0)
+            last = len(dat) - 1
+        elif last is None or last >= len(dat):
+            last = len(dat) - 1
 
-    name = response.name
-    if response.attributes.get("cap"):
-        name += "@" + response.attributes.get("cap") + " ★"
+        if first >= len(dat) or last < first:
+            headers["Content-Range"] = f"bytes */{len(dat)}"
+            return Response(status_code=416, headers=headers)
 
-        if response.attributes.get("nameColor"):
-            name = f'<font color="{response.attributes.get("nameColor")}">{name}</font>'
+        headers["Content-Range"] = f"bytes {first}-{last}/{len(dat)}"
+        return Response(
+            content=dat[first : last + 1],
+            status_code=206,
+            headers=headers,
+            media_type="text/plain; charset=shift_jis",
+        )
 
-    return PlainTextResponse(
-        (
-            "\n".join(
-                [
-                    f"{name}<>{response.attributes.get('email', '')}<>{response.createdAt.strftime('%Y/%m/%d %H:%M:%S.%f')} ID:{response.shownId}<> {response.content.replace('\n', ' <br> ')} <>{thread.title if i == 0 else ''}"
-                    for i, response in enumerate(responses)
-                ]
-            )
-            + "\n"
-        ).encode("shift-jis", "ignore"),
+    return Response(
+        content=dat,
+        headers=headers,
         media_type="text/plain; charset=shift_jis",
     )
 
@@ -244,10 +318,7 @@ async def bbscgi(request: Request):
                 fields = response.parentId.rsplit("_", 1)
                 board = fields[0]
                 threadId = fields[1]
-                resNum = await DBService.pool.fetchval(
-                    "SELECT COUNT(*) FROM responses WHERE parent_id = $1",
-                    response.parentId,
-                )
+                resNum = response.num
             else:
                 board = bbs
                 threadId = key
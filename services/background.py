@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+import dotenv
+
+from .logger import log
+
+dotenv.load_dotenv()
+
+
+class BackgroundService:
+    # 書き込み後の通知やIP記録など、レスポンスを待たせたくない処理を流すキュー
+    # キューがいっぱいのときは新しい処理を捨てる
+    queue: Optional[asyncio.Queue] = None
+    workers: List[asyncio.Task] = []
+
+    maxQueueSize: int = int(os.getenv("backgroundQueueSize", 1024))
+    workerCount: int = int(os.getenv("backgroundWorkers", 4))
+
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    dropped: int = 0
+    totalLatency: float = 0
+    maxLatency: float = 0
+
+    @classmethod
+    def submit(cls, func: Callable[..., Awaitable[Any]], *args: Any) -> bool:
+        if cls.queue is None:
+            log.warning(f"BackgroundService is not running, dropped {func.__name__}")
+            cls.dropped += 1
+            return False
+
+        try:
+            cls.queue.put_nowait((time.monotonic(), func, args))
+        except asyncio.QueueFull:
+            log.warning(f"Background queue is full, dropped {func.__name__}")
+            cls.dropped += 1
+            return False
+
+        cls.submitted += 1
+        return True
+
+    @classmethod
+    async def worker(cls):
+        while True:
+            enqueuedAt, func, args = await cls.queue.get()
+            try:
+                await func(*args)
+                cls.completed += 1
+            except Exception:
+                cls.failed += 1
+                log.exception(f"Background task {func.__name__} failed")
+            finally:
+                latency = time.monotonic() - enqueuedAt
+                cls.totalLatency += latency
+                cls.maxLatency = max(cls.maxLatency, latency)
+                cls.queue.task_done()
+
+    @classmethod
+    def metrics(cls):
+        finished = cls.completed + cls.failed
+        return {
+            "queueDepth": cls.queue.qsize() if cls.queue else 0,
+            "maxQueueSize": cls.maxQueueSize,
+            "workers": cls.workerCount,
+            "submitted": cls.submitted,
+            "completed": cls.completed,
+            "failed": cls.failed,
+            "dropped": cls.dropped,
+            "averageLatency": cls.totalLatency / finished if finished else 0,
+            "maxLatency": cls.maxLatency,
+        }
+
+    @classmethod
+    async def run(cls):
+        cls.queue = asyncio.Queue(cls.maxQueueSize)
+        cls.workers = [
+            asyncio.create_task(cls.worker()) for _ in range(cls.workerCount)
+        ]
+
+    @classmethod
+    async def shutdown(cls, timeout: float = 20):
+        if cls.queue is None:
+            return
+
+        # 残っている処理を流し切ってから止める
+        try:
+            async with asyncio.timeout(timeout):
+                await cls.queue.join()
+        except TimeoutError:
+            log.warning(
+                f"Background queue was not drained, {cls.queue.qsize()} tasks left"
+            )
+
+        for worker in cls.workers:
+            worker.cancel()
+        await asyncio.gather(*cls.workers, return_exceptions=True)
+
+        cls.queue = None
+        cls.workers = []
@@ -0,0 +1,82 @@
+import hashlib
+from typing import Dict, Optional
+
+from objects import Board
+
+from .db import DBService
+from .pubsub import PubSubService
+
+CHANNEL = "QuaBoardInvalidation"
+
+
+class BoardCache:
+    boards: Dict[str, Board] = {}
+    versions: Dict[str, str] = {}
+    version: str = ""
+
+    @classmethod
+    def store(cls, board: Board):
+        cls.boards[board.id] = board
+        cls.versions[board.id] = hashlib.sha1(
+            board.model_dump_json().encode()
+        ).hexdigest()[:16]
+        cls.updateVersion()
+
+    @classmethod
+    def updateVersion(cls):
+        cls.version = hashlib.sha1(
+            "".join(
+                [f"{id}:{cls.versions[id]}" for id in sorted(cls.versions)]
+            ).encode()
+        ).hexdigest()[:16]
+
+    @classmethod
+    async def load(cls):
+        rows = await DBService.pool.fetch("SELECT * FROM boards")
+
+        cls.boards = {}
+        cls.versions = {}
+        for row in rows:
+            cls.store(Board.model_validate(dict(row)))
+        cls.updateVersion()
+
+    @classmethod
+    async def refresh(cls, id: str) -> Optional[Board]:
+        row = await DBService.pool.fetchrow("SELECT * FROM boards WHERE id = $1", id)
+        if not row:
+            cls.boards.pop(id, None)
+            cls.versions.pop(id, None)
+            cls.updateVersion()
+            return None
+
+        board = Board.model_validate(dict(row))
+        cls.store(board)
+        return board
+
+    @classmethod
+    async def get(cls, id: str) -> Optional[Board]:
+        board = cls.boards.get(id)
+        if board is None:
+            # 別のプロセスで作られたばかりの板かもしれないのでDBも見る
+            board = await cls.refresh(id)
+        return board
+
+    @classmethod
+    async def invalidate(cls, id: Optional[str] = None):
+        if id is None:
+            await cls.load()
+        else:
+            await cls.refresh(id)
+        await PubSubService.publish(CHANNEL, id or "*")
+
+    @classmethod
+    async def onMessage(cls, message: str):
+        if message == "*":
+            await cls.load()
+        else:
+            await cls.refresh(message)
+
+    @classmethod
+    async def run(cls):
+        await cls.load()
+        PubSubService.subscribe(CHANNEL, cls.onMessage)
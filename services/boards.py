@@ -1,5 +1,4 @@
 import asyncio
-import copy
 import html
 import math
 import os
@@ -7,18 +6,16 @@ import re
 import secrets
 import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
+import asyncpg
 import dotenv
-import emoji
 from pydantic import TypeAdapter
 
 from objects import (
     Board,
     Device,
-    Emoji,
     IdRow,
-    Reaction,
     RenderingResponseEvent,
     Response,
     ResponsePostEvent,
@@ -26,25 +23,33 @@ from objects import (
     ThreadPostEvent,
 )
 from services import emojiData
+from services.background import BackgroundService
+from services.boardCache import BoardCache
+from services.cache import LRUCache
 from services.db import DBService
 from services.exception import (
     BackendError,
     ContentTooLong,
     ContentTooShort,
-    PostRateLimit,
     VerificationRequired,
 )
 from services.id import generateId, tz
 from services.plugin import PluginService
-from services.socketio import sio
-from services.trip import generateTrip
+from services.pubsub import PubSubService
+from services.ratelimit import RateLimitService
+from services.socketio import hasSubscribers, sio
+from services.trip import getTrip
 
 dotenv.load_dotenv()
 
-boardTypeAdapter = TypeAdapter(List[Board])
-threadTypeAdapter = TypeAdapter(List[Thread])
 responseTypeAdapter = TypeAdapter(List[Response])
-reactionTypeAdapter = TypeAdapter(List[Reaction])
+
+ID_CHANNEL = "QuaIdInvalidation"
+
+# トークン → IdRow (キャップ変更やトークン削除のときはpub/subで消す)
+idCache = LRUCache(
+    int(os.getenv("idCacheSize", 4096)), ttl=float(os.getenv("idCacheTtl", 300))
+)
 
 
 async def createBoard(board: Board):
@@ -55,48 +60,156 @@ async def createBoard(board: Board):
         board.description,
         board.anonName,
     )
+    await BoardCache.invalidate(board.id)
+    return board
+
+
+async def updateBoard(board: Board):
+    await DBService.pool.execute(
+        """
+            UPDATE ONLY boards
+            SET name = $2,
+            description = $3,
+            anon_name = $4,
+            attributes = $5
+            WHERE id = $1
+        """,
+        board.id,
+        board.name,
+        board.description,
+        board.anonName,
+        board.attributes,
+    )
+    await BoardCache.invalidate(board.id)
     return board
 
 
 async def getBoard(id: str):
-    row = await DBService.pool.fetchrow("SELECT * FROM boards WHERE id = $1", id)
-    if not row:
+    board = await BoardCache.get(id)
+    if not board:
         raise NameError(f"Board {id} not found")
-    return Board.model_validate(dict(row))
+    return board
 
 
 async def getBoards():
-    rows = [dict(row) for row in await DBService.pool.fetch("SELECT * FROM boards")]
-    return boardTypeAdapter.validate_python(rows)
+    return list(BoardCache.boards.values())
 
 
-async def getThreadsInBoard(id: str, page: int = 0):
-    rows = []
+async def getBoardRevision(boardId: str) -> int:
+    return int(await DBService.redis.get(f"BoardRevision_{boardId}") or 0)
+
+
+async def bumpBoardRevision(boardId: str):
+    await DBService.redis.incr(f"BoardRevision_{boardId}")
+
+
+async def getThreadModifiedAt(boardId: str, id: int) -> datetime:
+    parentId = f"{boardId}_{id}"
+
+    # キャッシュにはそのときのリビジョンも一緒に入れておき、リビジョンが変わっていたら使わない
+    # (DBを読むより先にリビジョンを読むので、古い modified_at を新しいリビジョンで保存することはない)
+    revision, cached = await DBService.redis.mget(
+        f"ThreadRevision_{parentId}", f"ThreadModifiedAt_{parentId}"
+    )
+    revision = int(revision or 0)
+    if cached:
+        cachedRevision, timestamp = cached.split(b":", 1)
+        if int(cachedRevision) == revision:
+            return datetime.fromtimestamp(float(timestamp), tz)
+
+    modifiedAt = await DBService.pool.fetchval(
+        "SELECT modified_at FROM threads WHERE id = $1 AND deleted = false",
+        parentId,
+    )
+    if modifiedAt is None:
+        raise NameError(f"thread {id} not found")
+
+    await DBService.redis.set(
+        f"ThreadModifiedAt_{parentId}",
+        f"{revision}:{modifiedAt.timestamp()}",
+        ex=60 * 60 * 24,
+    )
+    return modifiedAt
+
 
+async def bumpThreadRevision(parentId: str):
+    # スレッドの modified_at を変えたら、コミットしてから呼ぶ
+    # (modified_at はホストの時計がずれていても戻らないように、GREATEST で必ず進めている)
+    # スレッド一覧にも modifiedAt が載っているので、板のリビジョンも一緒に上げる
+    async with DBService.redis.pipeline(transaction=False) as pipe:
+        pipe.incr(f"ThreadRevision_{parentId}")
+        pipe.incr(f"BoardRevision_{parentId.rsplit('_', 1)[0]}")
+        await pipe.execute()
+
+
+async def getDatRevision(parentId: str) -> int:
+    return int(await DBService.redis.get(f"DatRevision_{parentId}") or 0)
+
+
+async def bumpDatRevision(parentId: str):
+    # datの既存の行が変わる (タイトル変更・レスの編集や削除) ときに、コミットしてから呼ぶ
+    # レスが増えるだけなら呼ばない (datの後ろに足すだけで済む)
+    await DBService.redis.incr(f"DatRevision_{parentId}")
+
+
+def rowToThread(row) -> Thread:
+    row = dict(row)
+    row["board"] = row["board_id"]
+    row["id"] = row["key"]
+    return Thread.model_validate(row)
+
+
+async def getThreadsInBoard(id: str, page: int = 0):
     PAGE_SIZE = 20
 
-    for _row in await DBService.pool.fetch(
+    rows = await DBService.pool.fetch(
         """
             SELECT *
             FROM threads
-            WHERE id LIKE $1 AND deleted = false
-            ORDER BY sort_key DESC
+            WHERE board_id = $1 AND deleted = false
+            ORDER BY sort_key DESC, key DESC
             OFFSET $2 LIMIT $3
         """,
-        f"{id}_%",
+        id,
         page * PAGE_SIZE,
         PAGE_SIZE,
-    ):
-        row = dict(_row)
-        row["count"] = await DBService.pool.fetchval(
-            "SELECT COUNT(*) FROM responses WHERE parent_id = $1",
-            row["id"],
+    )
+
+    return [rowToThread(row) for row in rows]
+
+
+async def getThreadsInBoardAfter(
+    id: str, after: Optional[Tuple[int, int]] = None, limit: int = 20
+):
+    if after is None:
+        rows = await DBService.pool.fetch(
+            """
+                SELECT *
+                FROM threads
+                WHERE board_id = $1 AND deleted = false
+                ORDER BY sort_key DESC, key DESC
+                LIMIT $2
+            """,
+            id,
+            limit,
+        )
+    else:
+        rows = await DBService.pool.fetch(
+            """
+                SELECT *
+                FROM threads
+                WHERE board_id = $1 AND deleted = false
+                AND (sort_key, key) < ($2, $3)
+                ORDER BY sort_key DESC, key DESC
+                LIMIT $4
+            """,
+            id,
+            after[0],
+            after[1],
+            limit,
         )
-        row["board"] = row["id"].split("_")[0]
-        row["id"] = int(row["id"].split("_")[1])
-        rows.append(row)
 
-    return threadTypeAdapter.validate_python(rows)
+    return [rowToThread(row) for row in rows]
 
 
 async def getThreadInBoard(boardId: str, id: int):
@@ -106,21 +219,31 @@ async def getThreadInBoard(boardId: str, id: int):
     if not row:
         raise NameError(f"thread {id} not found")
 
-    row = dict(row)
-    row["count"] = await DBService.pool.fetchval(
-        "SELECT COUNT(*) FROM responses WHERE parent_id = $1", row["id"]
-    )
-    row["board"] = row["id"].split("_")[0]
-    row["id"] = int(row["id"].split("_")[1])
-    return Thread.model_validate(row)
+    return rowToThread(row)
 
 
-async def getResponsesInThread(boardId: str, id: str):
+async def getResponsesInThread(
+    boardId: str,
+    id: str,
+    includeDeleted: bool = False,
+    since: int = 0,
+    limit: Optional[int] = None,
+):
     rows = []
 
+    # since より後のレス番号だけを (parent_id, num) のインデックスで取る
     for _row in await DBService.pool.fetch(
-        "SELECT * FROM responses WHERE parent_id = $1 AND deleted = false ORDER by created_at ASC",
+        """
+            SELECT *
+            FROM responses
+            WHERE parent_id = $1 AND num > $3 AND (deleted = false OR $2)
+            ORDER by num ASC
+            LIMIT $4
+        """,
         f"{boardId}_{id}",
+        includeDeleted,
+        since,
+        limit,
     ):
         row = dict(_row)
         rows.append(row)
@@ -131,35 +254,43 @@ async def getResponsesInThread(boardId: str, id: str):
 async def updateThread(thread: Thread):
     await DBService.pool.execute(
         """
-            UPDATE ONLY responses
+            UPDATE ONLY threads
             SET title = $2,
+            modified_at = GREATEST(modified_at + interval '1 microsecond', now())
             WHERE id = $1
         """,
-        thread.id,
+        f"{thread.board}_{thread.id}",
         thread.title,
     )
+    await bumpDatRevision(f"{thread.board}_{thread.id}")
+    await bumpThreadRevision(f"{thread.board}_{thread.id}")
 
 
 async def updateResponse(response: Response):
-    response = copy.deepcopy(response)
-    for reaction in response.reactions:
-        del reaction.count
-
-    await DBService.pool.execute(
+    # リアクションは reactions テーブルで管理しているのでここでは書き換えない
+    parentId = await DBService.pool.fetchval(
         """
-            UPDATE ONLY responses
-            SET name = $2,
-            content = $3,
-            reactions = $4,
-            attributes = $5
-            WHERE id = $1
+            WITH updated AS (
+                UPDATE ONLY responses
+                SET name = $2,
+                content = $3,
+                attributes = $4
+                WHERE id = $1
+                RETURNING parent_id
+            )
+            UPDATE ONLY threads
+            SET modified_at = GREATEST(modified_at + interval '1 microsecond', now())
+            WHERE id IN (SELECT parent_id FROM updated)
+            RETURNING id
         """,
         response.id,
         response.name,
         response.content,
-        reactionTypeAdapter.dump_python(response.reactions, mode="json"),
         response.attributes,
     )
+    if parentId:
+        await bumpDatRevision(parentId)
+        await bumpThreadRevision(parentId)
 
 
 async def getVerifiedUser(command: str, cookies: Dict[str, str]) -> IdRow:
@@ -170,109 +301,154 @@ async def getVerifiedUser(command: str, cookies: Dict[str, str]) -> IdRow:
             raise VerificationRequired(os.getenv("turnstileSiteKey"))
         token = tokens[1]
 
-    row = await DBService.pool.fetchrow("SELECT * FROM ids WHERE token = $1", token)
-    if not row:
-        raise VerificationRequired(os.getenv("turnstileSiteKey"))
-    return IdRow.model_validate(dict(row))
+    idRow = idCache.get(token)
+    if idRow is None:
+        row = await DBService.pool.fetchrow("SELECT * FROM ids WHERE token = $1", token)
+        if not row:
+            raise VerificationRequired(os.getenv("turnstileSiteKey"))
+        idRow = IdRow.model_validate(dict(row))
+        idCache.set(token, idRow)
+    return idRow
+
+
+async def onIdInvalidation(token: str):
+    if token == "*":
+        idCache.clear()
+    else:
+        idCache.pop(token)
+
+
+PubSubService.subscribe(ID_CHANNEL, onIdInvalidation)
+
+
+async def invalidateId(token: str):
+    idCache.pop(token)
+    await PubSubService.publish(ID_CHANNEL, token)
+
+
+async def setCap(token: str, cap: Optional[str], capColor: Optional[str]):
+    await DBService.pool.execute(
+        "UPDATE ONLY ids SET cap = $1, cap_color = $2 WHERE token = $3",
+        cap,
+        capColor,
+        token,
+    )
+    await invalidateId(token)
+
+
+async def revokeToken(token: str):
+    await DBService.pool.execute("DELETE FROM ids WHERE token = $1", token)
+    await invalidateId(token)
 
 
 async def deleteThread(thread: Thread, hard: bool = False):
     if hard:
-        await DBService.pool.execute("DELETE from threads WHERE id = $1", thread.id)
+        await DBService.pool.execute(
+            "DELETE from threads WHERE id = $1", f"{thread.board}_{thread.id}"
+        )
     else:
         await DBService.pool.execute(
-            "UPDATE only threads SET deleted = true WHERE id = $1", thread.id
+            "UPDATE only threads SET deleted = true WHERE id = $1",
+            f"{thread.board}_{thread.id}",
         )
 
+    await bumpThreadRevision(f"{thread.board}_{thread.id}")
+
 
 async def deleteResponse(response: Response, hard: bool = False):
     if hard:
-        await DBService.pool.execute("DELETE from responses WHERE id = $1", response.id)
+        async with DBService.pool.acquire() as conn:
+            async with conn.transaction():
+                parentId = await conn.fetchval(
+                    "DELETE from responses WHERE id = $1 RETURNING parent_id",
+                    response.id,
+                )
+                # リアクションの行も一緒に消す
+                await conn.execute(
+                    "DELETE FROM reactions WHERE response_id = $1", response.id
+                )
+                if parentId:
+                    await conn.execute(
+                        """
+                            UPDATE ONLY threads
+                            SET count = count - 1,
+                            modified_at = GREATEST(modified_at + interval '1 microsecond', now())
+                            WHERE id = $1
+                        """,
+                        parentId,
+                    )
     else:
         await DBService.pool.execute(
-            "UPDATE only responses SET deleted = true WHERE id = $1", response.id
+            """
+                WITH deleted AS (
+                    UPDATE only responses SET deleted = true WHERE id = $1
+                    RETURNING parent_id
+                )
+                UPDATE ONLY threads
+                SET modified_at = GREATEST(modified_at + interval '1 microsecond', now())
+                WHERE id IN (SELECT parent_id FROM deleted)
+            """,
+            response.id,
         )
 
+    await bumpDatRevision(response.parentId)
+    await bumpThreadRevision(response.parentId)
 
-def sanitize(input: str):
-    # 基本的なサニタイズ
-    input = (
-        emoji.emojize(
-            input, delimiters=("::", "::"), language="alias", variant="emoji_type"
-        )
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-        .replace("\r\n", "\n")
-        .replace("\r", "\n")
-        .strip()
-        .strip(" ")
-        .strip("　")
-        .strip("\t")
-        .strip("\n")
-    )
-    return input
 
+def sanitize(input: str, boardAliases: Optional[Dict[str, str]] = None):
+    # 基本的なサニタイズ (replaceはCの速さで済むので、Pythonでのループは使わない)
+    input = emojiData.emojize(input, boardAliases)
+    input = input.replace("<", "&lt;").replace(">", "&gt;")
+    if "\r" in input:
+        input = input.replace("\r\n", "\n").replace("\r", "\n")
+    # 全角スペース・タブ・改行もまとめて削れる
+    return input.strip()
 
-def sanitizeRefs(text: str) -> str:
-    result = []
-    i = 0
-    while i < len(text):
-        if text[i] == "&" and i + 1 < len(text) and text[i + 1] == "#":
-            j = i + 2
-            base = 10
-            if j < len(text) and text[j] in "xX":
-                base = 16
-                j += 1
-
-            while j < len(text) and (
-                text[j].isdigit() or (base == 16 and text[j] in "abcdefABCDEF")
-            ):
-                j += 1
 
-            if j < len(text) and text[j] == ";":
-                result.append(text[i : j + 1])
-                i = j + 1
-                continue
-            else:
-                i = j
-                continue
-        else:
-            result.append(text[i])
-            i += 1
-    return "".join(result)
+# str.isdigit() が真になる文字 (全角数字や上付き数字も含む)
+digitClass = "".join(
+    [re.escape(char) for char in map(chr, range(0x110000)) if char.isdigit()]
+)
+refPattern = re.compile(f"&#(?:[xX][{digitClass}a-fA-F]*|[{digitClass}]*)(;)?")
+newlineRefPattern = re.compile(r"&#([Xx]0*[aA]|0*10);")
+
+
+def sanitizeRefs(text: str) -> str:
+    # ;で閉じている数値文字参照だけを残し、閉じていないものは&#から数字までを消す
+    if "&#" not in text:
+        return text
+    return refPattern.sub(lambda match: match[0] if match[1] else "", text)
 
 
-def sanitizeThreadName(name: str):
-    name = sanitize(name).replace('"', "&quot;")
-    name = re.sub(r"&#([Xx]0*[aA]|0*10);", "", name)
+def sanitizeThreadName(name: str, boardAliases: Optional[Dict[str, str]] = None):
+    name = sanitize(name, boardAliases).replace('"', "&quot;")
+    if "&#" in name:
+        name = newlineRefPattern.sub("", name)
     return sanitizeRefs(name)
 
 
-def sanitizeName(name: str):
-    name = (
-        sanitize(name)
-        .replace('"', "&quot;")
-        .replace("\n", "")
-        .replace("◆", "◇")
-        .replace("&#9670;", "◇")
-        .replace("★", "☆")
-        .replace("&#9733;", "☆")
-    )
+def sanitizeName(name: str, boardAliases: Optional[Dict[str, str]] = None):
+    name = sanitize(name, boardAliases).replace('"', "&quot;").replace("\n", "")
+    name = name.replace("◆", "◇").replace("★", "☆")
+    if "&#" in name:
+        name = name.replace("&#9670;", "◇").replace("&#9733;", "☆")
     return name
 
 
-def formatName(name: str, anonName: str) -> str:
+async def formatName(
+    name: str, anonName: str, boardAliases: Optional[Dict[str, str]] = None
+) -> str:
     if name != "":
         fields = name.rsplit("#", 1)
         if len(fields) <= 1:
-            return sanitizeName(fields[0])
+            return sanitizeName(fields[0], boardAliases)
         else:
             name, tripKey = tuple(fields)
 
-            name = sanitizeName(name)
-            tripKey = generateTrip(f"#{tripKey}")
+            name = sanitizeName(name, boardAliases)
+            tripKey = await getTrip(f"#{tripKey}")
             return f"{name}{tripKey}"
-    return sanitizeName(anonName)
+    return sanitizeName(anonName, boardAliases)
 
 
 def formatContent(content: str) -> str:
@@ -280,25 +456,107 @@ def formatContent(content: str) -> str:
     return content
 
 
+class SJISTable(dict):
+    # Shift-JISで表せない文字は数値文字参照にする (覚えておくと際限なく増えるので毎回作る)
+    def __missing__(self, code: int) -> str:
+        return f"&#{code};"
+
+
+def buildSJISTable() -> SJISTable:
+    # 1バイト・2バイトの全部の並びをデコードして、往復できる文字だけを残す
+    sequences = [bytes([byte]) for byte in range(0x100)]
+    for lead in [*range(0x81, 0xA0), *range(0xE0, 0xFD)]:
+        for trail in range(0x40, 0xFD):
+            sequences.append(bytes([lead, trail]))
+
+    table = SJISTable()
+    for sequence in sequences:
+        try:
+            char = sequence.decode("shift-jis")
+        except UnicodeDecodeError:
+            continue
+        if len(char) == 1 and char.encode("shift-jis").decode("shift-jis") == char:
+            table[ord(char)] = char
+    return table
+
+
+sjisTable = buildSJISTable()
+
+
 def emojiToHTML(text: str) -> str:
-    result = []
-    for char in text:
-        if char.encode("shift-jis", "ignore").decode("shift-jis", "ignore") != char:
-            result.append(f"&#{ord(char)};")
-        else:
-            result.append(char)
-    return "".join(result)
+    # ASCIIはすべてShift-JISで表せる
+    if text.isascii():
+        return text
+    return text.translate(sjisTable)
 
 
 async def updateIdIp(idRow: IdRow, ipAddress: str):
+    # キャッシュされたIdRowを使い回すので、既知のIPなら何もしない
+    if ipAddress in idRow.ips:
+        return
+
     idRow.ips.append(ipAddress)
     await DBService.pool.execute(
-        "UPDATE ONLY ids SET ips = $1 WHERE token = $2",
-        list(set(idRow.ips)),
+        """
+            UPDATE ONLY ids
+            SET ips = array_append(ips, $1)
+            WHERE token = $2 AND NOT ($1 = ANY(ips))
+        """,
+        ipAddress,
         idRow.token,
     )
 
 
+class ThreadNotifier:
+    # スレッド一覧の更新通知は板ごとに notificationInterval 秒まとめて、変わったスレッドだけ送る
+    interval: float = float(os.getenv("notificationInterval", 1))
+    pending: Dict[str, set] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def notify(cls, boardId: str, threadId: int):
+        cls.pending.setdefault(boardId, set()).add(threadId)
+
+        if boardId not in cls.tasks:
+            cls.tasks[boardId] = asyncio.create_task(cls.flushLater(boardId))
+
+    @classmethod
+    async def flushLater(cls, boardId: str):
+        try:
+            await asyncio.sleep(cls.interval)
+        finally:
+            del cls.tasks[boardId]
+
+        threadIds = cls.pending.pop(boardId, set())
+        if threadIds:
+            BackgroundService.submit(cls.flush, boardId, threadIds)
+
+    @classmethod
+    async def flush(cls, boardId: str, threadIds: set):
+        # 誰も見ていない板なら何もしない
+        if not await hasSubscribers(boardId):
+            return
+
+        rows = await DBService.pool.fetch(
+            """
+                SELECT *
+                FROM threads
+                WHERE board_id = $1 AND key = ANY($2::bigint[]) AND deleted = false
+            """,
+            boardId,
+            list(threadIds),
+        )
+
+        await sio.emit(
+            "updateThreads",
+            [
+                rowToThread(row).model_dump(mode="json", exclude={"ownerId"})
+                for row in rows
+            ],
+            boardId,
+        )
+
+
 async def postThread(
     *,
     boardId: str,
@@ -313,9 +571,10 @@ async def postThread(
 
     idRow = await getVerifiedUser(command, cookies)
 
-    title = emojiToHTML(sanitizeThreadName(title))
-    content = emojiToHTML(sanitize(formatContent(content)))
-    name = emojiToHTML(formatName(name, board.anonName))
+    boardAliases = emojiData.getBoardAliases(board.attributes)
+    title = emojiToHTML(sanitizeThreadName(title, boardAliases))
+    content = emojiToHTML(sanitize(formatContent(content), boardAliases))
+    name = emojiToHTML(await formatName(name, board.anonName, boardAliases))
 
     attributes = {}
     # キャップ
@@ -338,12 +597,7 @@ async def postThread(
 
     shownId = generateId(ipAddress, board.id)
 
-    ratelimit = await DBService.redis.get(f"PostThreadRateLimits_{idRow.id}")
-    if ratelimit and float(ratelimit) > time.time():
-        raise PostRateLimit(float(ratelimit) - time.time())
-    await DBService.redis.set(
-        f"PostThreadRateLimits_{idRow.id}", time.time() + 600, ex=60 * 60 * 24
-    )
+    await RateLimitService.check(board, "thread", idRow.id)
 
     # Run event
     event = ThreadPostEvent(
@@ -361,96 +615,102 @@ async def postThread(
     attributes = event.attributes
     shownId = event.shownId
 
-    # キー被り対策
-    while True:
-        key = math.floor(time.time())
-        if not await DBService.pool.fetchrow(
-            "SELECT * FROM threads WHERE id = $1", f"{board.id}_{key}"
-        ):
-            break
-        await asyncio.sleep(1)
-
-    row = await DBService.pool.fetchrow(
-        """
-            INSERT INTO threads
-            (id, created_at, title, sort_key, owner_id, owner_shown_id, host)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
-            RETURNING *
-        """,
-        f"{board.id}_{key}",
-        datetime.now(tz),
-        title,
-        key,
-        idRow.id,
-        shownId,
-        ipAddress,
-    )
-
-    row = dict(row)
-    row["count"] = await DBService.pool.fetchval(
-        "SELECT COUNT(*) FROM responses WHERE parent_id = $1", row["id"]
-    )
-    row["board"] = row["id"].split("_")[0]
-    row["id"] = int(row["id"].split("_")[1])
-    thread = Thread.model_validate(row)
-
-    await DBService.pool.execute(
-        """
-            INSERT INTO responses
-            (id, created_at, parent_id, author_id, shown_id, host, name, content, attributes)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-        """,
-        secrets.token_hex(6),
-        datetime.now(tz),
-        f"{board.id}_{key}",
-        idRow.id,
-        shownId,
-        ipAddress,
-        name,
-        content,
-        attributes,
-    )
+    createdAt = datetime.now(tz)
+
+    # コネクションはDBに書き込むあいだだけ借りる (トリップの計算やプラグインを待たせない)
+    async with DBService.pool.acquire() as conn:
+        async with conn.transaction():
+            # キー被り対策 (使われていたら次の秒にずらす)
+            key = math.floor(createdAt.timestamp())
+            while True:
+                row = await conn.fetchrow(
+                    """
+                        INSERT INTO threads
+                        (id, board_id, key, created_at, modified_at, title, sort_key, owner_id, owner_shown_id, host, count, last_num)
+                        VALUES ($1, $2, $3, $4, $4, $5, $6, $7, $8, $9, 1, 1)
+                        ON CONFLICT DO NOTHING
+                        RETURNING *
+                    """,
+                    f"{board.id}_{key}",
+                    board.id,
+                    key,
+                    createdAt,
+                    title,
+                    key,
+                    idRow.id,
+                    shownId,
+                    ipAddress,
+                )
+                if row:
+                    break
+                key += 1
+
+            await conn.execute(
+                """
+                    INSERT INTO responses
+                    (id, num, created_at, parent_id, author_id, shown_id, host, name, content, attributes)
+                    VALUES ($1, 1, $2, $3, $4, $5, $6, $7, $8, $9)
+                """,
+                secrets.token_hex(6),
+                createdAt,
+                f"{board.id}_{key}",
+                idRow.id,
+                shownId,
+                ipAddress,
+                name,
+                content,
+                attributes,
+            )
 
-    async def notification():
-        await sio.emit(
-            "updateThreads",
-            threadTypeAdapter.dump_python(
-                await getThreadsInBoard(board.id), mode="json"
-            ),
-            thread.board,
-        )
+    thread = rowToThread(row)
+    await bumpBoardRevision(thread.board)
 
-    asyncio.create_task(updateIdIp(idRow, ipAddress))
-    asyncio.create_task(notification())
+    ThreadNotifier.notify(thread.board, thread.id)
+    BackgroundService.submit(updateIdIp, idRow, ipAddress)
 
     return thread, idRow
 
 
-async def checkReactions(content: str, userId: str, parentId: str) -> List[Response]:
-    responses = []
+def parseReactions(content: str) -> Tuple[List[Tuple[int, str]], str]:
+    reactions = []
+    lines = []
 
-    lines = content.splitlines()
-    for line in lines:
+    for line in content.splitlines():
         fields = line.split(" ", 2)
-        if len(fields) < 2:
-            continue
-        anker, emoji = fields
+        if len(fields) == 2:
+            anker, emoji = fields
 
-        if not anker.startswith("&gt;&gt;") or not anker[8:].isdigit():
-            continue
-        if not emoji.startswith("+"):
-            continue
+            if (
+                anker.startswith("&gt;&gt;")
+                and anker[8:].isdigit()
+                and emoji.startswith("+")
+            ):
+                reactions.append((int(anker[8:]), html.unescape(emoji[1:])))
+                continue
+
+        lines.append(line)
 
-        resNum = int(anker[8:])
-        emoji = html.unescape(emoji[1:])
+    return reactions, "\n".join(lines)
 
-        responses.append(await addReaction(emoji, userId, parentId, resNum))
-        lines.remove(line)
 
-    return responses, "\n".join(lines)
+async def lockThread(conn: asyncpg.Connection, parentId: str):
+    # レスの行より先にスレッドの行をロックして、同じスレッドへの書き込みはここだけで待たせる
+    # (レス→スレッドの順でロックすると、複数のレスにリアクションする書き込み同士でデッドロックする)
+    row = await conn.fetchrow(
+        "SELECT id FROM threads WHERE id = $1 AND deleted = false FOR UPDATE",
+        parentId,
+    )
+    if not row:
+        raise NameError(f"thread {parentId} not found")
 
 
-async def addReaction(emojiChar: str, userId: str, parentId: str, resNum: int):
+async def addReaction(
+    emojiChar: str,
+    userId: str,
+    parentId: str,
+    resNum: int,
+    conn: Optional[asyncpg.Connection] = None,
+):
     _emoji = emojiData.checkEmoji(emojiChar)
     if isinstance(_emoji, bool):
         if not _emoji:
@@ -458,49 +718,303 @@ async def addReaction(emojiChar: str, userId: str, parentId: str, resNum: int):
     else:
         emojiChar = _emoji
 
-    board, thread = parentId.rsplit("_", 1)
+    emojiName = emojiToHTML(emojiChar)
 
-    try:
-        response = (await getResponsesInThread(board, thread))[resNum - 1]
-    except IndexError:
+    if resNum < 1:
         raise BackendError("REACTION_RESPONSE_NOT_FOUND", "レスが存在しません")
 
-    if len(response.reactions) >= 20:
+    if conn is None:
+        async with DBService.pool.acquire() as conn:
+            async with conn.transaction():
+                await lockThread(conn, parentId)
+                response = await toggleReaction(
+                    conn, emojiName, userId, parentId, resNum
+                )
+        await bumpThreadRevision(parentId)
+        return response
+
+    return await toggleReaction(conn, emojiName, userId, parentId, resNum)
+
+
+async def toggleReaction(
+    conn: asyncpg.Connection, emojiName: str, userId: str, parentId: str, resNum: int
+):
+    # 呼び出し側で lockThread してから呼ぶこと (ロックの順番はスレッド→レス)
+    # 対象のレスをロックして、同時に来たリアクションを直列化する
+    row = await conn.fetchrow(
+        """
+            SELECT id, reactions
+            FROM responses
+            WHERE parent_id = $1 AND num = $2 AND deleted = false
+            FOR UPDATE
+        """,
+        parentId,
+        resNum,
+    )
+    if not row:
+        raise BackendError("REACTION_RESPONSE_NOT_FOUND", "レスが存在しません")
+
+    emojiNames = [reaction["emoji"]["name"] for reaction in row["reactions"]]
+    if emojiName not in emojiNames and len(emojiNames) >= 20:
         raise BackendError(
             "REACTION_LIMIT_EXCEEDED",
             "1つのレスにつけられるリアクションの数は20個までです",
         )
 
-    found = False
-    for reaction in response.reactions:
-        if userId in reaction.userIds:
-            if reaction.emoji.name == emojiToHTML(emojiChar):
-                reaction.userIds.remove(userId)
-                found = True
-        else:
-            if reaction.emoji.name == emojiToHTML(emojiChar):
-                reaction.userIds.append(userId)
-                found = True
-
-        if len(reaction.userIds) <= 0:
-            response.reactions.remove(reaction)
-
-    if not found:
-        response.reactions.append(
-            Reaction(
-                emoji=Emoji(id=None, name=emojiToHTML(emojiChar)), user_ids=[userId]
+    # 付いていれば外す、付いていなければ付ける
+    await conn.execute(
+        """
+            WITH removed AS (
+                DELETE FROM reactions
+                WHERE response_id = $1 AND emoji = $2 AND user_id = $3
+                RETURNING 1
             )
-        )
+            INSERT INTO reactions (response_id, emoji, user_id)
+            SELECT $1, $2, $3
+            WHERE NOT EXISTS (SELECT 1 FROM removed)
+        """,
+        row["id"],
+        emojiName,
+        userId,
+    )
 
-    await updateResponse(response)
+    row = await conn.fetchrow(
+        """
+            WITH summary AS (
+                SELECT COALESCE(
+                    json_agg(
+                        json_build_object(
+                            'emoji', json_build_object('id', NULL, 'name', emoji),
+                            'count', count
+                        )
+                        ORDER BY first
+                    ),
+                    '[]'::json
+                ) AS reactions
+                FROM (
+                    SELECT emoji, COUNT(*) AS count, MIN(created_at) AS first
+                    FROM reactions
+                    WHERE response_id = $1
+                    GROUP BY emoji
+                ) AS counts
+            ),
+            touched AS (
+                UPDATE ONLY threads
+                SET modified_at = GREATEST(modified_at + interval '1 microsecond', now())
+                WHERE id = $2
+            )
+            UPDATE ONLY responses
+            SET reactions = (SELECT reactions FROM summary)
+            WHERE id = $1
+            RETURNING *
+        """,
+        row["id"],
+        parentId,
+    )
 
+    response = Response.model_validate(dict(row))
     for reaction in response.reactions:
-        reaction.count = len(reaction.userIds)
         del reaction.userIds
 
     return response
 
 
+def maxResponsesExceeded() -> BackendError:
+    return BackendError(
+        "MAX_RESPONSE_EXDEEDED",
+        "スレッドが最大レス数に到達しました。次スレを建てるなら今です！！",
+    )
+
+
+async def insertResponse(
+    conn: asyncpg.Connection,
+    *,
+    parentId: str,
+    maxResponses: int,
+    authorId: str,
+    shownId: str,
+    host: str,
+    name: str,
+    content: str,
+    attributes: Dict[str, Any],
+) -> Response:
+    createdAt = datetime.now(tz)
+
+    # スレッドの行をロックしてレス番号を採番する
+    # (last_num は減らさないので、最後のレスを消しても同じ番号は使われない)
+    thread = await conn.fetchrow(
+        """
+            UPDATE ONLY threads
+            SET sort_key = $1, count = count + 1, last_num = last_num + 1,
+            modified_at = GREATEST(modified_at + interval '1 microsecond', $3)
+            WHERE id = $2 AND deleted = false
+            RETURNING count, last_num
+        """,
+        math.floor(time.time()),
+        parentId,
+        createdAt,
+    )
+    if thread is None:
+        raise NameError(f"thread {parentId} not found")
+    if thread["count"] > maxResponses:
+        raise maxResponsesExceeded()
+
+    row = await conn.fetchrow(
+        """
+            INSERT INTO responses
+            (id, num, created_at, parent_id, author_id, shown_id, host, name, content, attributes)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+            RETURNING *
+        """,
+        secrets.token_hex(6),
+        thread["last_num"],
+        createdAt,
+        parentId,
+        authorId,
+        shownId,
+        host,
+        name,
+        content,
+        attributes,
+    )
+    return Response.model_validate(dict(row))
+
+
+class ResponseBatcher:
+    # 数ミリ秒の間に来たレスをまとめて1トランザクションで書き込む (グループコミット)
+    def __init__(self, window: float):
+        self.window = window
+        self.pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self.flushTask: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def submit(self, **values) -> Response:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((values, future))
+
+        if self.flushTask is None:
+            self.flushTask = asyncio.create_task(self.flushLater())
+
+        return await future
+
+    async def flushLater(self):
+        await asyncio.sleep(self.window)
+
+        pending, self.pending = self.pending, []
+        self.flushTask = None
+
+        try:
+            await self.flush(pending)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def flush(self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        # デッドロックしないように、スレッドはid順にロックする
+        parentIds = sorted({values["parentId"] for values, _ in pending})
+        sortKey = math.floor(time.time())
+        accepted = []
+        modifiedAt = {}
+
+        async with DBService.pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    """
+                        SELECT id, count, last_num
+                        FROM threads
+                        WHERE id = ANY($1::varchar[]) AND deleted = false
+                        ORDER BY id
+                        FOR UPDATE
+                    """,
+                    parentIds,
+                )
+                counts = {row["id"]: row["count"] for row in rows}
+                nums = {row["id"]: row["last_num"] for row in rows}
+
+                for values, future in pending:
+                    parentId = values["parentId"]
+                    if future.done():
+                        continue
+                    if parentId not in counts:
+                        future.set_exception(NameError(f"thread {parentId} not found"))
+                        continue
+                    if counts[parentId] >= values["maxResponses"]:
+                        future.set_exception(maxResponsesExceeded())
+                        continue
+
+                    counts[parentId] += 1
+                    nums[parentId] += 1
+                    modifiedAt[parentId] = datetime.now(tz)
+                    accepted.append(
+                        (
+                            {
+                                "id": secrets.token_hex(6),
+                                "num": nums[parentId],
+                                "created_at": modifiedAt[parentId],
+                                "parent_id": parentId,
+                                "author_id": values["authorId"],
+                                "shown_id": values["shownId"],
+                                "host": values["host"],
+                                "name": values["name"],
+                                "content": values["content"],
+                                "reactions": [],
+                                "attributes": values["attributes"],
+                            },
+                            future,
+                        )
+                    )
+
+                if not accepted:
+                    return
+
+                await conn.executemany(
+                    """
+                        UPDATE ONLY threads
+                        SET sort_key = $2, count = $3, last_num = $4,
+                        modified_at = GREATEST(modified_at + interval '1 microsecond', $5)
+                        WHERE id = $1
+                    """,
+                    [
+                        (parentId, sortKey, counts[parentId], nums[parentId], createdAt)
+                        for parentId, createdAt in modifiedAt.items()
+                    ],
+                )
+                await conn.executemany(
+                    """
+                        INSERT INTO responses
+                        (id, num, created_at, parent_id, author_id, shown_id, host, name, content, attributes)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                    """,
+                    [
+                        (
+                            row["id"],
+                            row["num"],
+                            row["created_at"],
+                            row["parent_id"],
+                            row["author_id"],
+                            row["shown_id"],
+                            row["host"],
+                            row["name"],
+                            row["content"],
+                            row["attributes"],
+                        )
+                        for row, _ in accepted
+                    ],
+                )
+
+        for row, future in accepted:
+            if not future.done():
+                future.set_result(Response.model_validate(row))
+
+
+# responseBatchWindow (ミリ秒) が0より大きいときだけ有効
+responseBatcher = ResponseBatcher(float(os.getenv("responseBatchWindow", 0)) / 1000)
+
+
 async def postResponse(
     *,
     boardId: str,
@@ -512,12 +1026,14 @@ async def postResponse(
     ipAddress: str,
 ):
     board = await getBoard(boardId)
+
     thread = await getThreadInBoard(board.id, threadId)
 
     idRow = await getVerifiedUser(command, cookies)
 
-    content = sanitize(formatContent(content))
-    name = emojiToHTML(formatName(name, board.anonName))
+    boardAliases = emojiData.getBoardAliases(board.attributes)
+    content = sanitize(formatContent(content), boardAliases)
+    name = emojiToHTML(await formatName(name, board.anonName, boardAliases))
 
     attributes = {}
     # キャップ
@@ -534,28 +1050,19 @@ async def postResponse(
     if len(content) > 9192:
         raise ContentTooLong("本文", 9192)
 
-    if await DBService.pool.fetchval(
-        "SELECT COUNT(*) FROM responses WHERE parent_id = $1",
-        f"{thread.board}_{thread.id}",
-    ) >= thread.attributes.get("maxResponses", 1000):
-        raise BackendError(
-            "MAX_RESPONSE_EXDEEDED",
-            "スレッドが最大レス数に到達しました。次スレを建てるなら今です！！",
-        )
+    maxResponses = thread.attributes.get("maxResponses", 1000)
+    if thread.count >= maxResponses:
+        raise maxResponsesExceeded()
 
     shownId = generateId(ipAddress, board.id)
 
-    ratelimit = await DBService.redis.get(f"PostResponseRateLimits_{idRow.id}")
-    if ratelimit and float(ratelimit) > time.time():
-        raise PostRateLimit(float(ratelimit) - time.time())
-    await DBService.redis.set(
-        f"PostResponseRateLimits_{idRow.id}", time.time() + 5, ex=60 * 60 * 24
-    )
+    # リアクション (いくつ付けても1回の書き込みとして数える)
+    # 先に見ておけば、リアクションで弾かれたときにレスの枠を使わずに済む
+    reactions, content = parseReactions(content)
+    if reactions:
+        await RateLimitService.check(board, "reaction", idRow.id)
 
-    # リアクション
-    responses, content = await checkReactions(
-        content, idRow.id, f"{thread.board}_{thread.id}"
-    )
+    await RateLimitService.check(board, "response", idRow.id)
 
     # Run event
     event = ResponsePostEvent(
@@ -572,37 +1079,52 @@ async def postResponse(
     attributes = event.attributes
     shownId = event.shownId
 
-    if content.strip() != "":
-        row = await DBService.pool.fetchrow(
-            """
-                INSERT INTO responses
-                (id, created_at, parent_id, author_id, shown_id, host, name, content, attributes)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                RETURNING *
-            """,
-            secrets.token_hex(6),
-            datetime.now(tz),
-            f"{thread.board}_{thread.id}",
-            idRow.id,
-            shownId,
-            ipAddress,
-            name,
-            emojiToHTML(content),
-            attributes,
-        )
-        response = Response.model_validate(dict(row))
-
-        await DBService.pool.execute(
-            "UPDATE ONLY threads SET sort_key = $1 WHERE id = $2",
-            time.time(),
-            f"{thread.board}_{thread.id}",
-        )
-    else:
-        response = None
+    parentId = f"{thread.board}_{thread.id}"
+
+    values = {
+        "parentId": parentId,
+        "maxResponses": maxResponses,
+        "authorId": idRow.id,
+        "shownId": shownId,
+        "host": ipAddress,
+        "name": name,
+        "content": emojiToHTML(content),
+        "attributes": attributes,
+    }
+    response = None
+
+    # コネクションはDBに書き込むあいだだけ借りる (トリップの計算やプラグインを待たせない)
+    async with DBService.pool.acquire() as conn:
+        # リアクション・レスの追加・スレッドの更新は全部まとめてコミットする
+        async with conn.transaction():
+            # リアクションがなければ insertResponse の UPDATE が最初にスレッドの行をロックする
+            if reactions:
+                await lockThread(conn, parentId)
+
+            responses = []
+            for resNum, emojiChar in reactions:
+                responses.append(
+                    await addReaction(emojiChar, idRow.id, parentId, resNum, conn)
+                )
+
+            if content.strip() != "" and not responseBatcher.enabled:
+                response = await insertResponse(conn, **values)
+
+    # まとめて書き込む場合はリアクションをコミットしてから渡す (スレッドの行ロック待ちを避ける)
+    if content.strip() != "" and responseBatcher.enabled:
+        response = await responseBatcher.submit(**values)
+
+    # リアクションだけでもスレッドの modified_at は変わる
+    if response or responses:
+        await bumpThreadRevision(parentId)
 
     async def notification():
         nonlocal response
 
+        # 誰も見ていないスレッドならレスの組み立てを省く
+        if not await hasSubscribers(parentId):
+            return
+
         if response:
             # Run event
             event = RenderingResponseEvent(thread, response, Device.OfficialClient)
@@ -622,18 +1144,12 @@ async def postResponse(
                     responses, mode="json"
                 ),
             },
-            f"{thread.board}_{thread.id}",
-        )
-
-        await sio.emit(
-            "updateThreads",
-            threadTypeAdapter.dump_python(
-                await getThreadsInBoard(board.id), mode="json"
-            ),
-            thread.board,
+            parentId,
         )
 
-    asyncio.create_task(updateIdIp(idRow, ipAddress))
-    asyncio.create_task(notification())
+    if response:
+        ThreadNotifier.notify(thread.board, thread.id)
+    BackgroundService.submit(updateIdIp, idRow, ipAddress)
+    BackgroundService.submit(notification)
 
     return response, idRow
@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    # maxBytes を指定すると、sizeOf で測った値の合計がそれを超えないように古いものから捨てる
+    def __init__(
+        self,
+        maxSize: int,
+        ttl: Optional[float] = None,
+        maxBytes: Optional[int] = None,
+        sizeOf: Callable[[Any], int] = len,
+    ):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.sizeOf = sizeOf
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.items: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        value, expiresAt = item
+        if expiresAt is not None and expiresAt <= time.monotonic():
+            self.pop(key)
+            self.misses += 1
+            return default
+
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.pop(key)
+
+        expiresAt = time.monotonic() + self.ttl if self.ttl is not None else None
+        self.items[key] = (value, expiresAt)
+        if self.maxBytes is not None:
+            self.bytes += self.sizeOf(value)
+
+        while len(self.items) > self.maxSize or (
+            self.maxBytes is not None and self.bytes > self.maxBytes
+        ):
+            self.pop(next(iter(self.items)))
+
+    def pop(self, key: Hashable):
+        item = self.items.pop(key, None)
+        if item is not None and self.maxBytes is not None:
+            self.bytes -= self.sizeOf(item[0])
+
+    def clear(self):
+        self.items.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
@@ -0,0 +1,36 @@
+import hashlib
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+
+def makeETag(*parts) -> str:
+    return (
+        '"'
+        + hashlib.sha1(":".join([str(part) for part in parts]).encode()).hexdigest()[
+            :16
+        ]
+        + '"'
+    )
+
+
+def isNotModified(request: Request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    # Cloudflareが圧縮するとW/付きの弱いETagになって返ってくる
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in tags
+
+
+def validatorHeaders(etag: str, headers: Optional[Dict[str, str]] = None):
+    # 毎回検証させるが、変わっていなければ304で済ませる
+    return {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+
+
+def notModified(etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(status_code=304, headers=validatorHeaders(etag, headers))
@@ -0,0 +1,119 @@
+import asyncio
+import os
+from typing import Dict, Tuple
+
+import dotenv
+
+from objects import Device, RenderingResponseEvent, Response, Thread
+from services.boards import getDatRevision, getResponsesInThread
+from services.cache import LRUCache
+from services.plugin import PluginService
+
+dotenv.load_dotenv()
+
+# スレッドごとの (datのリビジョン, 最後のレス番号, datのバイト列)
+# 新しいレスは後ろに足していき、既存の行が変わったときだけ作り直す
+# (新しさは時計がずれうる modified_at ではなく、リビジョンと threads.last_num で見る)
+datCache = LRUCache(
+    int(os.getenv("datCacheSize", 512)),
+    maxBytes=int(os.getenv("datCacheBytes", 64 * 1024 * 1024)),
+    sizeOf=lambda entry: len(entry[2]),
+)
+# 組み立て中のdat (同じスレッドのdatは同時に1つしか組み立てない)
+datBuilds: Dict[str, asyncio.Task] = {}
+
+
+def formatDatLine(thread: Thread, response: Response, isFirst: bool) -> str:
+    title = thread.title if isFirst else ""
+
+    # 削除されたレスも行として残して、既存のバイトオフセットがずれないようにする
+    if response.deleted:
+        return f"あぼーん<>あぼーん<>あぼーん<>あぼーん<>{title}\n"
+
+    # Run event
+    event = RenderingResponseEvent(thread, response, Device.Monazilla)
+    for plugin in PluginService.plugins:
+        try:
+            plugin.onRenderingResponse(event)
+        except NotImplementedError:
+            pass
+
+    response = event.response
+
+    # リアクションの数は載せない (既存の行が変わると、差分取得のバイトオフセットがずれる)
+    content = response.content
+
+    name = response.name
+    if response.attributes.get("cap"):
+        name += "@" + response.attributes.get("cap") + " ★"
+
+        if response.attributes.get("nameColor"):
+            name = f'<font color="{response.attributes.get("nameColor")}">{name}</font>'
+
+    createdAt = response.createdAt.strftime("%Y/%m/%d %H:%M:%S.%f")
+    content = content.replace("\n", " <br> ")
+
+    return (
+        f"{name}<>{response.attributes.get('email', '')}<>{createdAt} ID:{response.shownId}"
+        f"<> {content} <>{title}\n"
+    )
+
+
+def isFresh(entry: Tuple[int, int, bytes], revision: int, thread: Thread) -> bool:
+    return entry[0] >= revision and entry[1] >= thread.lastNum
+
+
+async def buildDat(thread: Thread) -> Tuple[int, int, bytes]:
+    key = f"{thread.board}_{thread.id}"
+
+    # クエリより先にリビジョンを読んでおけば、古い行を新しいリビジョンで保存することはない
+    revision = await getDatRevision(key)
+
+    cached = datCache.get(key)
+    if cached and cached[0] == revision:
+        if cached[1] >= thread.lastNum:
+            return cached
+        _, lastNum, dat = cached
+    else:
+        lastNum, dat = 0, b""
+
+    responses = await getResponsesInThread(
+        thread.board, thread.id, includeDeleted=True, since=lastNum
+    )
+    if responses:
+        dat += "".join(
+            [
+                formatDatLine(thread, response, not dat and i == 0)
+                for i, response in enumerate(responses)
+            ]
+        ).encode("shift-jis", "ignore")
+        lastNum = responses[-1].num
+
+    # 最後のレスが消されていても、thread.lastNum までは読み終わっている
+    entry = (revision, max(lastNum, thread.lastNum), dat)
+    datCache.set(key, entry)
+    return entry
+
+
+async def buildDatOnce(key: str, thread: Thread) -> Tuple[int, int, bytes]:
+    try:
+        return await buildDat(thread)
+    finally:
+        datBuilds.pop(key, None)
+
+
+async def getDat(thread: Thread) -> bytes:
+    key = f"{thread.board}_{thread.id}"
+    revision = await getDatRevision(key)
+
+    while True:
+        task = datBuilds.get(key)
+        if task is None:
+            task = asyncio.create_task(buildDatOnce(key, thread))
+            datBuilds[key] = task
+
+        # 他のリクエストが組み立て中ならそれを待つ (待っている側が切断しても組み立ては続ける)
+        entry = await asyncio.shield(task)
+        # 古いリビジョンやスレッド情報で組み立てられていたら、もう一度組み立てる
+        if isFresh(entry, revision, thread):
+            return entry[2]
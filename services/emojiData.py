@@ -1,4 +1,6 @@
-from typing import Union
+import re
+import unicodedata
+from typing import Dict, Optional, Union
 
 import emoji
 
@@ -19,3 +21,59 @@ def checkEmoji(char: str) -> Union[bool, str]:
         return True
     else:
         return False
+
+
+def buildShortcodes() -> Dict[str, str]:
+    # emoji.emojize(language="alias", variant="emoji_type") と同じ対応表を一度だけ作る
+    # (エイリアスが英語名より優先され、どちらも先に見つかったものが使われる)
+    aliases = {}
+    names = {}
+    for char, data in emoji.EMOJI_DATA.items():
+        if data["status"] > emoji.STATUS["fully_qualified"]:
+            continue
+
+        if "variant" in data:
+            if char[-1] in "\ufe0e\ufe0f":
+                char = char[:-1]
+            char += "\ufe0f"
+
+        for alias in data.get("alias", []):
+            aliases.setdefault(alias[1:-1], char)
+        if "en" in data:
+            names.setdefault(data["en"][1:-1], char)
+
+    return {**names, **aliases}
+
+
+shortcodes = buildShortcodes()
+# ショートコードに使える文字 (emoji 2.x の emoji.core._EMOJI_NAME_PATTERN と同じ)
+# ライブラリの非公開の値なので、参照せずにここに持っておく
+EMOJI_NAME_PATTERN = (
+    "\\w\\-&.\u2019\u201d\u201c()!#*+,/\xab\xbb"
+    "\u0300\u0301\u0302\u0303\u0306\u0308\u030a\u0327"
+    "\u064b\u064e\u064f\u0650\u0653\u0654\u3099\u30fb\u309a\u0655"
+)
+shortcodePattern = re.compile(f"::([{EMOJI_NAME_PATTERN}]+)::")
+
+
+def emojize(text: str, boardAliases: Optional[Dict[str, str]] = None) -> str:
+    # ほとんどの書き込みには :: がないので、そのまま返す
+    if "::" not in text:
+        return text
+
+    def replace(match: re.Match) -> str:
+        name = unicodedata.normalize("NFKC", match[1])
+        if boardAliases and name in boardAliases:
+            return boardAliases[name]
+        return shortcodes.get(name, match[0])
+
+    return shortcodePattern.sub(replace, text)
+
+
+def getBoardAliases(attributes: Dict[str, str]) -> Dict[str, str]:
+    # 板ごとの絵文字は attributes に "emoji:名前": "置き換える文字" で入れる
+    return {
+        unicodedata.normalize("NFKC", key[6:]): value
+        for key, value in attributes.items()
+        if key.startswith("emoji:")
+    }
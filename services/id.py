@@ -2,22 +2,56 @@ import base64
 import hashlib
 import hmac
 import os
+import time
 from datetime import datetime, timedelta, timezone
 
 import dotenv
 
+from .cache import LRUCache
+
 dotenv.load_dotenv()
 tz = timezone(timedelta(hours=9), "Asia/Tokyo")
 
+# 鍵を入れたHMACを作っておいて、毎回copy()して使う
+idEncryptKey = os.getenv("idEncryptKey")
+idKey = (
+    hmac.new(idEncryptKey.encode("utf-8"), digestmod=hashlib.sha1)
+    if idEncryptKey
+    else None
+)
+
+# (IP, 板) → その日のID (日本時間の0時に全部捨てる)
+shownIdCache = LRUCache(int(os.getenv("shownIdCacheSize", 65536)))
+today = ""
+tomorrowAt = 0.0
+
+
+def rotateDay():
+    global today, tomorrowAt
+
+    now = datetime.now(tz)
+    today = now.strftime("%Y-%m-%d")
+    tomorrowAt = (
+        now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    ).timestamp()
+    shownIdCache.clear()
+
 
 def generateId(ipAddress: str, boardId: str):
-    timestamp = datetime.now(tz).strftime("%Y-%m-%d")
-    data = f"{timestamp}-{ipAddress}-{boardId}"
+    if time.time() >= tomorrowAt:
+        rotateDay()
+
+    shownId = shownIdCache.get((ipAddress, boardId))
+    if shownId is not None:
+        return shownId
+
+    data = f"{today}-{ipAddress}-{boardId}"
 
-    idHash = hmac.new(
-        os.getenv("idEncryptKey").encode("utf-8"), data.encode("utf-8"), hashlib.sha1
-    ).hexdigest()
+    idHash = idKey.copy()
+    idHash.update(data.encode("utf-8"))
 
-    idBase64 = base64.b64encode(idHash.encode()).decode()
+    idBase64 = base64.b64encode(idHash.hexdigest().encode()).decode()
 
-    return idBase64[:8]
+    shownId = idBase64[:8]
+    shownIdCache.set((ipAddress, boardId), shownId)
+    return shownId
@@ -0,0 +1,21 @@
+import os
+from typing import Callable, Hashable
+
+import dotenv
+
+from .cache import LRUCache
+
+dotenv.load_dotenv()
+
+# 板の情報から作るShift-JISのバイト列 (板のバージョンが変わるまで使い回す)
+pageCache = LRUCache(int(os.getenv("pageCacheSize", 256)))
+
+
+def getCachedPage(key: Hashable, version: str, render: Callable[[], bytes]) -> bytes:
+    cached = pageCache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    content = render()
+    pageCache.set(key, (version, content))
+    return content
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .db import DBService
+from .logger import log
+
+# ワーカー間でキャッシュの無効化などを伝えるためのRedis pub/sub
+# 再接続したときは取りこぼしがあるかもしれないので、全ハンドラに "*" を流す
+
+
+class PubSubService:
+    handlers: Dict[str, List[Callable[[str], Awaitable[None]]]] = {}
+    task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def subscribe(cls, channel: str, handler: Callable[[str], Awaitable[None]]):
+        cls.handlers.setdefault(channel, []).append(handler)
+
+    @classmethod
+    async def publish(cls, channel: str, message: str):
+        await DBService.redis.publish(channel, message)
+
+    @classmethod
+    async def dispatch(cls, channel: str, message: str):
+        for handler in cls.handlers.get(channel, []):
+            try:
+                await handler(message)
+            except Exception:
+                log.exception(f"PubSub handler for {channel} failed")
+
+    @classmethod
+    async def listen(cls):
+        reconnected = False
+        while True:
+            try:
+                async with DBService.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(*cls.handlers.keys())
+
+                    if reconnected:
+                        for channel in cls.handlers.keys():
+                            await cls.dispatch(channel, "*")
+
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        await cls.dispatch(
+                            message["channel"].decode(), message["data"].decode()
+                        )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("PubSub connection lost, reconnecting")
+                reconnected = True
+                await asyncio.sleep(1)
+
+    @classmethod
+    async def run(cls):
+        if cls.handlers:
+            cls.task = asyncio.create_task(cls.listen())
+
+    @classmethod
+    async def shutdown(cls):
+        if cls.task:
+            cls.task.cancel()
+            try:
+                await cls.task
+            except asyncio.CancelledError:
+                pass
+            cls.task = None
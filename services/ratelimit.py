@@ -0,0 +1,102 @@
+import math
+import time
+from typing import Dict, Optional
+
+from objects import Board
+
+from .boardCache import BoardCache
+from .db import DBService
+from .exception import PostRateLimit
+
+# 板の attributes で上書きできる (例: "threadRateLimit": "600")
+DEFAULT_INTERVALS = {
+    "thread": 600,
+    "response": 5,
+    "reaction": 0,
+}
+
+KEY_PREFIXES = {
+    "thread": "PostThreadRateLimits",
+    "response": "PostResponseRateLimits",
+    "reaction": "ReactionRateLimits",
+}
+
+# 最後に通った時刻を持ち、チェックする板の間隔が過ぎていれば今の時刻を書き込んで0を、
+# まだなら残り秒数を返す (期限ではなく時刻を持つので、別の板の間隔に引きずられない)
+HIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local last = tonumber(redis.call("GET", KEYS[1]) or "0")
+local remain = last + tonumber(ARGV[2]) - now
+if remain > 0 then
+    return tostring(remain)
+end
+redis.call("SET", KEYS[1], tostring(now), "EX", ARGV[3])
+return "0"
+"""
+
+
+class RedisRateLimiter:
+    def __init__(self):
+        self.script = DBService.redis.register_script(HIT_SCRIPT)
+
+    async def hit(self, key: str, interval: float, ttl: float) -> float:
+        remain = await self.script(
+            keys=[key], args=[time.time(), interval, math.ceil(ttl) + 1]
+        )
+        return float(remain)
+
+
+class MemoryRateLimiter:
+    def __init__(self):
+        self.lastHits: Dict[str, float] = {}
+
+    async def hit(self, key: str, interval: float, ttl: float) -> float:
+        now = time.time()
+        remain = self.lastHits.get(key, 0) + interval - now
+        if remain > 0:
+            return remain
+
+        self.lastHits[key] = now
+        return 0
+
+
+class RateLimitService:
+    limiter: Optional[object] = None
+
+    @classmethod
+    def getLimiter(cls):
+        if cls.limiter is None:
+            if DBService.redis is None:
+                cls.limiter = MemoryRateLimiter()
+            else:
+                cls.limiter = RedisRateLimiter()
+        return cls.limiter
+
+    @classmethod
+    def getInterval(cls, board: Board, action: str) -> float:
+        return float(
+            board.attributes.get(f"{action}RateLimit", DEFAULT_INTERVALS[action])
+        )
+
+    @classmethod
+    def getMaxInterval(cls, board: Board, action: str) -> float:
+        # 最後の時刻は一番長い間隔の板で見られるまで残しておく
+        return max(
+            [cls.getInterval(board, action)]
+            + [cls.getInterval(other, action) for other in BoardCache.boards.values()]
+        )
+
+    @classmethod
+    async def check(cls, board: Board, action: str, userId: str):
+        interval = cls.getInterval(board, action)
+        if interval <= 0:
+            return
+
+        # 間隔は板ごとに変えられるが、数えるのは板をまたいでユーザーごと
+        remain = await cls.getLimiter().hit(
+            f"{KEY_PREFIXES[action]}_{userId}",
+            interval,
+            cls.getMaxInterval(board, action),
+        )
+        if remain > 0:
+            raise PostRateLimit(remain)
@@ -1,8 +1,158 @@
+import asyncio
+import os
+import secrets
+from typing import Dict, Optional, Set
+
+import dotenv
 import socketio
 
-sio = socketio.AsyncServer(async_mode="asgi")
+from .boardCache import BoardCache
+from .db import DBService
+from .logger import log
+
+dotenv.load_dotenv()
+
+# ワーカーごとの購読者数を RoomSubscribers_{workerId} に持ち、ワーカーの一覧を RoomSubscriberWorkers に持つ
+ROOM_WORKERS_KEY = "RoomSubscriberWorkers"
+WORKER_ID = secrets.token_hex(8)
+ROOM_SUBSCRIBERS_KEY = f"RoomSubscribers_{WORKER_ID}"
+
+# 1つの接続で入れる部屋の数 (板一覧とスレッドで足りる)
+MAX_ROOMS_PER_SID = 8
+# この間隔で自分の購読者数を書き直す (Redis が消えても戻るように)
+HEARTBEAT_INTERVAL = 30
+
+# socketioManager=redis にすると、他のワーカー/ホストで受けた書き込みの通知も
+# Redis pub/sub 経由で全員に届くようになる (README の「複数ワーカーで動かす」を参照)
+if os.getenv("socketioManager") == "redis":
+    clientManager = socketio.AsyncRedisManager(
+        os.getenv("socketioRedis") or os.getenv("redis"),
+        channel=os.getenv("socketioChannel", "qua-socketio"),
+    )
+else:
+    clientManager = None
+
+sio = socketio.AsyncServer(async_mode="asgi", client_manager=clientManager)
+
+# このワーカーでの購読者数
+localRooms: Dict[str, int] = {}
+sidRooms: Dict[str, Set[str]] = {}
+heartbeatTask: Optional[asyncio.Task] = None
+
+# どれかのワーカーに購読者がいれば1を返す (ハッシュが期限切れのワーカーは一覧から外す)
+HAS_SUBSCRIBERS_SCRIPT = """
+for _, worker in ipairs(redis.call("SMEMBERS", KEYS[1])) do
+    local key = "RoomSubscribers_" .. worker
+    if redis.call("EXISTS", key) == 0 then
+        redis.call("SREM", KEYS[1], worker)
+    elseif tonumber(redis.call("HGET", key, ARGV[1]) or "0") > 0 then
+        return 1
+    end
+end
+return 0
+"""
+hasSubscribersScript = None
+
+
+async def hasSubscribers(room: str) -> bool:
+    global hasSubscribersScript
+
+    if localRooms.get(room, 0) > 0:
+        return True
+
+    if hasSubscribersScript is None:
+        hasSubscribersScript = DBService.redis.register_script(HAS_SUBSCRIBERS_SCRIPT)
+    return await hasSubscribersScript(keys=[ROOM_WORKERS_KEY], args=[room]) == 1
+
+
+async def getRoomOccupancy() -> Dict[str, int]:
+    occupancy = {}
+    for worker in await DBService.redis.smembers(ROOM_WORKERS_KEY):
+        rooms = await DBService.redis.hgetall(f"RoomSubscribers_{worker.decode()}")
+        for room, count in rooms.items():
+            occupancy[room.decode()] = occupancy.get(room.decode(), 0) + int(count)
+    return occupancy
+
+
+async def writeRoom(room: str):
+    # 増減ではなくこのワーカーでの数をそのまま書くので、Redis とずれても次で直る
+    async with DBService.redis.pipeline(transaction=True) as pipe:
+        if localRooms.get(room, 0) > 0:
+            pipe.hset(ROOM_SUBSCRIBERS_KEY, room, localRooms[room])
+        else:
+            pipe.hdel(ROOM_SUBSCRIBERS_KEY, room)
+        pipe.expire(ROOM_SUBSCRIBERS_KEY, HEARTBEAT_INTERVAL * 3)
+        pipe.sadd(ROOM_WORKERS_KEY, WORKER_ID)
+        await pipe.execute()
+
+
+async def writeAllRooms():
+    async with DBService.redis.pipeline(transaction=True) as pipe:
+        pipe.delete(ROOM_SUBSCRIBERS_KEY)
+        if localRooms:
+            pipe.hset(ROOM_SUBSCRIBERS_KEY, mapping=localRooms)
+        pipe.expire(ROOM_SUBSCRIBERS_KEY, HEARTBEAT_INTERVAL * 3)
+        pipe.sadd(ROOM_WORKERS_KEY, WORKER_ID)
+        await pipe.execute()
+
+
+async def heartbeat():
+    while True:
+        try:
+            await writeAllRooms()
+        except Exception:
+            log.exception("Failed to write room subscribers")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def startHeartbeat():
+    global heartbeatTask
+    heartbeatTask = asyncio.create_task(heartbeat())
+
+
+async def stopHeartbeat():
+    global heartbeatTask
+
+    if heartbeatTask is not None:
+        heartbeatTask.cancel()
+        await asyncio.gather(heartbeatTask, return_exceptions=True)
+        heartbeatTask = None
+
+    await DBService.redis.delete(ROOM_SUBSCRIBERS_KEY)
+    await DBService.redis.srem(ROOM_WORKERS_KEY, WORKER_ID)
+
+
+def isValidRoom(room: str) -> bool:
+    # 板 ("{boardId}") かスレッド ("{boardId}_{key}") の部屋だけに入れる
+    if not isinstance(room, str):
+        return False
+    if room in BoardCache.boards:
+        return True
+
+    boardId, _, key = room.rpartition("_")
+    return key.isascii() and key.isdigit() and boardId in BoardCache.boards
 
 
 @sio.event
 async def joinRoom(sid: str, room: str):
+    if not isValidRoom(room):
+        return
+
+    rooms = sidRooms.setdefault(sid, set())
+    if room in rooms or len(rooms) >= MAX_ROOMS_PER_SID:
+        return
+
     await sio.enter_room(sid, room)
+    rooms.add(room)
+    localRooms[room] = localRooms.get(room, 0) + 1
+    await writeRoom(room)
+
+
+@sio.event
+async def disconnect(sid: str, reason: Optional[str] = None):
+    for room in sidRooms.pop(sid, set()):
+        localRooms[room] -= 1
+        if localRooms[room] <= 0:
+            del localRooms[room]
+
+        await writeRoom(room)
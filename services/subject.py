@@ -0,0 +1,38 @@
+from typing import Dict, Tuple
+
+from objects import Board
+from services.boards import getBoardRevision
+from services.db import DBService
+
+# 板ごとのsubject.txtのバイト列 (板のリビジョンが変わるまで使い回す)
+subjectCache: Dict[str, Tuple[int, int, bytes]] = {}
+
+
+async def getSubject(board: Board) -> bytes:
+    limit = int(board.attributes.get("subjectCount", 80))
+
+    # クエリより先にリビジョンを読んでおけば、古い一覧を新しいリビジョンで保存することはない
+    revision = await getBoardRevision(board.id)
+
+    cached = subjectCache.get(board.id)
+    if cached and cached[0] == revision and cached[1] == limit:
+        return cached[2]
+
+    rows = await DBService.pool.fetch(
+        """
+            SELECT key, title, count
+            FROM threads
+            WHERE board_id = $1 AND deleted = false
+            ORDER BY sort_key DESC, key DESC
+            LIMIT $2
+        """,
+        board.id,
+        limit,
+    )
+
+    subject = "".join(
+        [f"{row['key']}.dat<>{row['title']} ({row['count']})\n" for row in rows]
+    ).encode("shift-jis")
+
+    subjectCache[board.id] = (revision, limit, subject)
+    return subject
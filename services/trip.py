@@ -1,18 +1,37 @@
 # https://github.com/utgwkk/20210103-sketch-tripcode
 # MITライセンスなので、ありがたく使わせてもらいます
 
+import asyncio
+import os
 import re
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
 
+import dotenv
 from passlib.hash import des_crypt
 
+from .cache import LRUCache
+
+dotenv.load_dotenv()
+
+hexTripPattern = re.compile(r"^#([0-9a-fA-F]{16})([\./0-9A-Za-z]{0,2})$")
+saltPattern = re.compile(rb"[^\.-z]")
+saltTable = bytes.maketrans(b":;<=>?@[\\]^_`", b"ABCDEFGabcdef")
+
+# トリップキー → トリップ (固定ハンドルは何度も同じキーで書き込まれる)
+tripCache = LRUCache(int(os.getenv("tripCacheSize", 4096)))
+# DESの計算でイベントループを止めないように別スレッドで計算する
+tripExecutor = ThreadPoolExecutor(
+    int(os.getenv("tripWorkers", 2)), thread_name_prefix="trip"
+)
+
 
 def generateTrip(tripstr: str):
     if len(tripstr[1:]) >= 12:
         mark = tripstr[0]
         if mark == "#" or mark == "$":
-            m = re.match(r"^#([0-9a-fA-F]{16})([\./0-9A-Za-z]{0,2})$", tripstr)
+            m = hexTripPattern.match(tripstr)
             if m:
                 trip = des_crypt.hash(
                     bytes(int(m.group(1)), "shift-jis"),
@@ -29,10 +48,24 @@ def generateTrip(tripstr: str):
         # treat as Shift-JIS bytes
         tripkey = bytes(tripkey, encoding="shift-jis")
         salt = (tripkey + b"H.")[1:3]
-        salt = re.sub(rb"[^\.-z]", b".", salt)
-        salt = salt.translate(bytes.maketrans(b":;<=>?@[\\]^_`", b"ABCDEFGabcdef"))
+        salt = saltPattern.sub(b".", salt)
+        salt = salt.translate(saltTable)
         trip = des_crypt.hash(tripkey, salt=salt.decode("shift-jis"))
         trip = trip[-10:]
     trip = "◆" + trip
 
     return trip
+
+
+async def getTrip(tripstr: str) -> str:
+    trip = tripCache.get(tripstr)
+    if trip is not None:
+        return trip
+
+    trip = await asyncio.get_running_loop().run_in_executor(
+        tripExecutor, generateTrip, tripstr
+    )
+    # 長すぎるキーでキャッシュを埋められないようにする
+    if len(tripstr) <= 64:
+        tripCache.set(tripstr, trip)
+    return trip
@@ -1,4 +1,6 @@
 const board = window.location.href.split("/")[3];
+const threadListSize = 20;
+let threadList = [];
 
 /*
   スレッドをスレッド一覧へ追加するために使用する関数
@@ -30,16 +32,35 @@ function appendThread(threads, threadListElement) {
   }
 }
 
+/*
+  updateThreadsで届いた(変更のあった)スレッドだけを一覧に反映する関数
+*/
+function applyThreadDeltas(threads) {
+  threads.forEach((thread) => {
+    const index = threadList.findIndex((t) => t.id == thread.id);
+    if (index !== -1) {
+      threadList[index] = thread;
+    } else {
+      threadList.push(thread);
+    }
+  });
+
+  threadList.sort((a, b) => b.sortKey - a.sortKey || b.id - a.id);
+  threadList = threadList.slice(0, threadListSize);
+}
+
 /*
   スレッド一覧のロードに使用する関数
 */
 async function loadThreadList() {
   const threadListElement = document.querySelector(".thread-list");
 
-  const response = await fetch(`/api/boards/${board}/threads`);
-  const threads = await response.json();
+  const response = await fetch(
+    `/api/boards/${board}/threads?limit=${threadListSize}`
+  );
+  threadList = await response.json();
 
-  appendThread(threads, threadListElement);
+  appendThread(threadList, threadListElement);
 }
 
 /*
@@ -113,8 +134,10 @@ document.addEventListener("DOMContentLoaded", async () => {
   });
 
   sio.on("updateThreads", (threads) => {
-    if (threads[0].board == board) {
-      appendThread(jsonData.threads, threadListElement);
+    threads = threads.filter((thread) => thread.board == board);
+    if (threads.length > 0) {
+      applyThreadDeltas(threads);
+      appendThread(threadList, threadListElement);
       playNotificationSound();
     }
   });
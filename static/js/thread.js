@@ -1,6 +1,8 @@
 const board = window.location.href.split("/")[3];
 const threadId = window.location.href.split("/")[4];
-let threadCount = 0;
+let lastNum = 0;
+// 表示済みのレス番号 (ライブで届いたレスと取り直したレスが前後しても重複・欠落しないように)
+let shownNums = new Set();
 
 /*
   文字のコンテンツ側デコレーションに使用する関数
@@ -37,13 +39,18 @@ function decoration(content) {
 /*
   レスの表示に使用する関数
 */
-async function appendResponse(response, i, responsesElement) {
+async function appendResponse(response, responsesElement) {
+  if (shownNums.has(response.num)) return;
+  shownNums.add(response.num);
+  lastNum = Math.max(lastNum, response.num);
+
   const element = document.createElement("div");
-  element.className = `response res-${i} res-${response.id}`;
+  element.className = `response res-${response.num - 1} res-${response.id}`;
+  element.dataset.num = response.num;
 
   const responseDetailElement = document.createElement("span");
   responseDetailElement.classList.add("detail");
-  responseDetailElement.innerHTML = `${i + 1} : <span style="color: ${
+  responseDetailElement.innerHTML = `${response.num} : <span style="color: ${
     response.attributes.nameColor ?? "green"
   };"><b>${emojiParse(response.name)}${
     response.attributes.cap
@@ -79,7 +86,16 @@ async function appendResponse(response, i, responsesElement) {
   });
   element.append(responseEmojisElement);
 
-  responsesElement.append(element);
+  // 後から届いた古いレスは番号順の位置に入れる
+  let next = null;
+  for (
+    let child = responsesElement.lastElementChild;
+    child !== null && Number(child.dataset.num) > response.num;
+    child = child.previousElementSibling
+  ) {
+    next = child;
+  }
+  responsesElement.insertBefore(element, next);
 }
 
 /*
@@ -92,12 +108,26 @@ async function loadResponses() {
   const responses = await response.json();
 
   responsesElement.textContent = "";
+  lastNum = 0;
+  shownNums = new Set();
   for (let i = 0; i < responses.length; i++) {
-    const response = responses[i];
+    appendResponse(responses[i], responsesElement);
+  }
+}
+
+/*
+  再接続したときなどに、まだ表示していないレスだけを取ってくる関数
+*/
+async function loadNewResponses(since) {
+  const responsesElement = document.querySelector(".responses");
 
-    appendResponse(response, i, responsesElement);
+  const response = await fetch(
+    `/api/boards/${board}/threads/${threadId}?since=${since}`
+  );
+  const responses = await response.json();
 
-    threadCount += 1;
+  for (let i = 0; i < responses.length; i++) {
+    appendResponse(responses[i], responsesElement);
   }
 }
 
@@ -162,8 +192,12 @@ document.addEventListener("DOMContentLoaded", async () => {
   });
 
   connectGateway();
-  sio.on("connect", () => {
+  sio.on("connect", async () => {
+    // 部屋に入る前の番号を覚えておき、そこから差分だけ取り直す
+    // (最初の読み込みから入室までと、切断中に書き込まれたレスを取りこぼさないように)
+    const since = lastNum;
     sio.emit("joinRoom", `${board}_${threadId}`);
+    await loadNewResponses(since);
   });
 
   sio.on("newResponse", (response) => {
@@ -171,8 +205,7 @@ document.addEventListener("DOMContentLoaded", async () => {
       threadInfoElement.scrollTop >= threadInfoElement.scrollHeight - 500;
 
     if (response.response !== null) {
-      appendResponse(response.response, threadCount, responsesElement);
-      threadCount += 1;
+      appendResponse(response.response, responsesElement);
 
       if (isAtBottom) {
         threadInfoElement.scrollTop = threadInfoElement.scrollHeight;
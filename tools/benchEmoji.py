@@ -0,0 +1,57 @@
+import random
+import timeit
+
+from services.boards import emojiToHTML
+
+
+def oldEmojiToHTML(text: str) -> str:
+    result = []
+    for char in text:
+        if char.encode("shift-jis", "ignore").decode("shift-jis", "ignore") != char:
+            result.append(f"&#{ord(char)};")
+        else:
+            result.append(char)
+    return "".join(result)
+
+
+def makeCorpus() -> dict:
+    random.seed(14)
+
+    japanese = "今日はいい天気ですね。明日も晴れるといいな！ｗｗｗ　それな～"
+    emojis = "😀😂🥺👍🔥✨🎉💯🙏🤔"
+    aa = "　　∧＿∧\n　（　´∀｀）\n　（　　　　）\n　｜ ｜　|\n　（_＿）＿）\n"
+
+    return {
+        "ascii": "".join(
+            random.choices("abcdefghijklmnopqrstuvwxyz0123456789 \n", k=9000)
+        ),
+        "japanese": (japanese * 300)[:9000],
+        "mixed": "".join(
+            random.choice([japanese, emojis[random.randrange(len(emojis))], "w"])
+            for _ in range(400)
+        )[:9000],
+        "emoji": (emojis * 900)[:9000],
+        "aa": (aa * 200)[:9000],
+        "name": "名無しさん🍣",
+    }
+
+
+def main():
+    for name, text in makeCorpus().items():
+        assert emojiToHTML(text) == oldEmojiToHTML(text), name
+
+        number = 200
+        old = timeit.timeit(lambda: oldEmojiToHTML(text), number=number) / number
+        new = timeit.timeit(lambda: emojiToHTML(text), number=number) / number
+        print(
+            f"{name:>10}: {len(text):>5}文字 "
+            f"old {old * 1e6:10.1f}us  new {new * 1e6:8.1f}us  x{old / new:.1f}"
+        )
+
+    # Unicodeの全文字で結果が同じことも確かめる
+    everything = "".join([chr(code) for code in range(0x110000)])
+    assert emojiToHTML(everything) == oldEmojiToHTML(everything)
+    print("全文字で一致しました")
+
+
+main()
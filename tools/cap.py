@@ -1,5 +1,6 @@
 import asyncio
 
+from services.boards import setCap
 from services.db import DBService
 
 
@@ -16,12 +17,7 @@ async def main():
     if capColor == "":
         capColor = None
 
-    await DBService.pool.execute(
-        "UPDATE ONLY ids SET cap = $1, cap_color = $2 WHERE token = $3",
-        cap,
-        capColor,
-        token,
-    )
+    await setCap(token, cap, capColor)
 
     await DBService.shutdown()
 
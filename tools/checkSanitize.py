@@ -0,0 +1,135 @@
+import json
+import random
+import sys
+from pathlib import Path
+
+from services.boards import formatContent, sanitize, sanitizeName, sanitizeThreadName
+
+GOLDEN = Path(__file__).parent / "golden" / "sanitize.json"
+
+FUNCTIONS = {
+    "content": lambda text: sanitize(formatContent(text)),
+    "threadName": sanitizeThreadName,
+    "name": sanitizeName,
+}
+
+CASES = [
+    "",
+    "   ",
+    "　テスト　",
+    "\t\n 本文 \n\t",
+    "a\r\nb\rc\nd",
+    "\r\n\r\n",
+    "<script>alert(1)</script>",
+    '"quoted" & <tag attr="x">',
+    "&lt;already escaped&gt;",
+    "&#10;&#x0a;&#X0A;&#00010;&#x000A;",
+    "&#9670;&#9733;◆★",
+    "名無し◆abc★",
+    "&#65;&#x41;&#X41;&#;&#x;",
+    "&#65&#x41 &#xyz; &#abc;",
+    "&#&#10;10;",
+    "&#1&#10;;",
+    "&&#10;#65;",
+    "&#²³;&#①;&#１２;",
+    "&#x１f;&#xFFFF",
+    "末尾&#",
+    "末尾&#x",
+    "::smile::",
+    "::+1:: ::thumbsup:: ::not_an_alias::",
+    ":::smile:::",
+    "::smile:::: ::",
+    "::<smile>::",
+    "😀🥺👍",
+    "　　∧＿∧\r\n　（　´∀｀）\r\n　（　　　　）",
+]
+
+TOKENS = [
+    "a",
+    "あ",
+    "漢",
+    " ",
+    "　",
+    "\t",
+    "\n",
+    "\r",
+    "\r\n",
+    "<",
+    ">",
+    '"',
+    "&",
+    "#",
+    ";",
+    "x",
+    "X",
+    "0",
+    "1",
+    "9",
+    "a",
+    "F",
+    "²",
+    "１",
+    "&#",
+    "&#x",
+    "&#10;",
+    "&#x0a;",
+    "&#9670;",
+    "&#9733;",
+    "◆",
+    "★",
+    "::",
+    "smile",
+    "::smile::",
+    "::+1::",
+    "😀",
+]
+
+
+def makeCorpus() -> list:
+    random.seed(14)
+    corpus = list(CASES)
+    for _ in range(1000):
+        corpus.append("".join(random.choices(TOKENS, k=random.randint(1, 24))))
+    return corpus
+
+
+def render(corpus: list) -> dict:
+    return {
+        name: [function(text) for text in corpus]
+        for name, function in FUNCTIONS.items()
+    }
+
+
+def main():
+    corpus = makeCorpus()
+    outputs = render(corpus)
+
+    if "--update" in sys.argv:
+        GOLDEN.write_text(
+            json.dumps(
+                {"inputs": corpus, "outputs": outputs}, ensure_ascii=False, indent=1
+            ),
+            encoding="utf-8",
+        )
+        print(f"{GOLDEN} を更新しました")
+        return
+
+    golden = json.loads(GOLDEN.read_text(encoding="utf-8"))
+    assert (
+        golden["inputs"] == corpus
+    ), "入力が変わっています。--update で作り直してください"
+
+    failures = 0
+    for name, expected in golden["outputs"].items():
+        for text, want, got in zip(corpus, expected, outputs[name]):
+            if want != got:
+                failures += 1
+                print(f"{name}: {text!r}\n  expected {want!r}\n  got      {got!r}")
+
+    if failures:
+        print(f"{failures}件一致しませんでした")
+        sys.exit(1)
+    print(f"{len(corpus)}件すべて一致しました")
+
+
+main()
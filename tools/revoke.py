@@ -0,0 +1,20 @@
+import asyncio
+
+from services.boards import revokeToken
+from services.db import DBService
+
+
+async def main():
+    await DBService.run()
+
+    token = input("トークン: ")
+
+    if not await DBService.pool.fetchrow("SELECT * FROM ids WHERE token = $1", token):
+        raise Exception("IDが存在しないけど")
+
+    await revokeToken(token)
+
+    await DBService.shutdown()
+
+
+asyncio.run(main())